@@ -1,13 +1,77 @@
 import streamlit as st
 import json
 import os
+import glob
+import uuid
+import sqlite3
+import hmac
+import base64
+import binascii
 import hashlib
+import time
+import atexit
+import traceback
 import datetime
+import functools
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
-# File to store user data
+# Accounts and their analysis history live in SQLite (WAL mode, so readers
+# don't block the writer and each write only touches its own rows)
+USER_DB = "user_data.sqlite3"
+# The previous whole-file JSON store, imported into USER_DB once; the import
+# is recorded in the settings table along with the users it brought in
 USER_DB_FILE = "user_data.json"
 
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    email TEXT,
+    created_at TEXT,
+    last_login TEXT
+);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL REFERENCES users (username),
+    file_name TEXT,
+    description TEXT,
+    file_hash TEXT,
+    timestamp TEXT NOT NULL,
+    event_id TEXT
+);
+CREATE INDEX IF NOT EXISTS history_user ON history (username, id);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# History events are appended to a JSON Lines log first and folded into the
+# history table in the background. Each process appends to a log of its own,
+# HISTORY_LOG_PREFIX plus a random id, and keeps touching it while it runs; a
+# log untouched for HISTORY_LOG_STALE_AFTER seconds was left by a stopped
+# process and is folded in and deleted by the next writer that finds it
+HISTORY_LOG_PREFIX = "user_data.history"
+HISTORY_LOG_STALE_AFTER = 60.0
+# The buffered events are written (one fsync per batch) once this many are
+# waiting or this many seconds have passed
+HISTORY_FLUSH_EVENTS = 100
+HISTORY_FLUSH_INTERVAL = 1.0
+# The log is compacted into the database once it grows past this size or
+# this many seconds after the last compaction
+HISTORY_COMPACT_BYTES = 1024 * 1024
+HISTORY_COMPACT_INTERVAL = 30.0
+# Entries per page of get_user_history_page
+HISTORY_PAGE_SIZE = 5
+
+# User records recently looked up by get_user, least recently used first
+USER_CACHE_SIZE = 256
+_user_cache = OrderedDict()  # username -> (store version, record or None)
+_user_cache_lock = threading.Lock()
+_local_writes = 0  # bumped by this process's own writes to users
+
 def init_session_state():
     """Initialize the session state variables if they don't exist"""
     if 'logged_in' not in st.session_state:
@@ -17,60 +81,308 @@ def init_session_state():
     if 'login_time' not in st.session_state:
         st.session_state.login_time = None
 
-def hash_password(password):
-    """Create a simple hash of the password"""
-    return hashlib.sha256(password.encode()).hexdigest()
+# Passwords are stored as "pbkdf2_sha256$<iterations>$<salt>$<hash>" (salt and
+# hash base64), so the work factor can be raised without invalidating stored
+# hashes. Unless PASSWORD_HASH_ITERATIONS is set, the work factor is calibrated
+# to about PASSWORD_HASH_TARGET_MS per hash the first time the store needs it
+# and kept in the settings table, so every process and restart agrees on it.
+# It never goes below PASSWORD_MIN_ITERATIONS
+PASSWORD_ALGORITHM = "pbkdf2_sha256"
+PASSWORD_MIN_ITERATIONS = 150_000
+PASSWORD_HASH_TARGET_MS = float(os.getenv('PASSWORD_HASH_TARGET_MS', 50))
+PASSWORD_SALT_BYTES = 16
 
-def load_users():
-    """Load users from the JSON file"""
-    if os.path.exists(USER_DB_FILE):
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+
+def hash_password(password, iterations=None):
+    """Create a salted PBKDF2 hash of the password"""
+    iterations = iterations or password_iterations()
+    salt = os.urandom(PASSWORD_SALT_BYTES)
+    digest = _pbkdf2(password, salt, iterations)
+    return "$".join([PASSWORD_ALGORITHM, str(iterations),
+                     base64.b64encode(salt).decode(), base64.b64encode(digest).decode()])
+
+def verify_password(password, stored):
+    """
+    Check a password against a stored hash. Returns (matches, needs_rehash);
+    needs_rehash is set for legacy unsalted SHA-256 hashes and for hashes
+    made with fewer than password_iterations() iterations. A malformed
+    stored hash never matches
+    """
+    parts = stored.split("$")
+    if parts[0] == PASSWORD_ALGORITHM:
+        if len(parts) != 4:
+            return False, False
+        try:
+            iterations = int(parts[1])
+            salt = base64.b64decode(parts[2], validate=True)
+            expected = base64.b64decode(parts[3], validate=True)
+        except (ValueError, binascii.Error):
+            return False, False
+        if iterations < 1:
+            return False, False
+        matches = hmac.compare_digest(_pbkdf2(password, salt, iterations), expected)
+        return matches, matches and iterations < password_iterations()
+    # Hashes from before salting: a bare SHA-256 hex digest
+    matches = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+    return matches, matches
+
+def calibrate_password_iterations(target_seconds=0.05, samples=5):
+    """Iterations that make one hash take about target_seconds on this machine"""
+    probe = 20_000
+    best = float("inf")
+    for _ in range(samples):
+        start = time.perf_counter()
+        _pbkdf2("calibration", os.urandom(PASSWORD_SALT_BYTES), probe)
+        best = min(best, time.perf_counter() - start)
+    # Round to a thousand to keep the stored format readable
+    return max(1000, int(probe * target_seconds / best) // 1000 * 1000)
+
+@functools.lru_cache(maxsize=1)
+def password_iterations():
+    """The PBKDF2 work factor for new hashes: PASSWORD_HASH_ITERATIONS, or the calibrated value kept in the store"""
+    if os.getenv('PASSWORD_HASH_ITERATIONS'):
+        return int(os.getenv('PASSWORD_HASH_ITERATIONS'))
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT value FROM settings WHERE key = 'password_iterations'").fetchone()
+        if row is None:
+            calibrated = max(PASSWORD_MIN_ITERATIONS, calibrate_password_iterations(PASSWORD_HASH_TARGET_MS / 1000))
+            # The first process to calibrate wins, so all of them hash alike
+            conn.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('password_iterations', ?)",
+                         (str(calibrated),))
+            row = conn.execute("SELECT value FROM settings WHERE key = 'password_iterations'").fetchone()
+    finally:
+        conn.close()
+    return int(row[0])
+
+@functools.lru_cache(maxsize=None)
+def _init_db(path):
+    # Create the store at this absolute path once per process, importing the
+    # JSON store unless that's been done. Keyed by path so a change of working
+    # directory never leaves a store without its schema
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        # Stores created before history events had ids
+        if 'event_id' not in {row[1] for row in conn.execute("PRAGMA table_info(history)")}:
+            conn.execute("ALTER TABLE history ADD COLUMN event_id TEXT")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS history_event ON history (event_id)")
+        if conn.execute("SELECT 1 FROM settings WHERE key = 'json_imported'").fetchone() is None:
+            _import_json(conn, USER_DB_FILE, mark=True)
+    finally:
+        conn.close()
+
+def _connect():
+    """Open the user store"""
+    path = os.path.abspath(USER_DB)
+    _init_db(path)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _insert_history(conn, username, history):
+    """Add JSON-store style history entries of one user, keeping the event ids of entries from load_users"""
+    conn.executemany(
+        "INSERT INTO history (username, file_name, description, file_hash, timestamp, event_id) VALUES (?, ?, ?, ?, ?, ?)",
+        [(username, entry.get('file_name'), entry.get('description'), entry.get('file_hash'),
+          entry['timestamp'].isoformat() if isinstance(entry['timestamp'], datetime) else entry['timestamp'],
+          entry.get('event_id'))
+         for entry in history]
+    )
+
+def _write_users(conn, users):
+    """Insert or replace the given users, history included, in one transaction"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for username, user in users.items():
+            conn.execute(
+                "INSERT OR REPLACE INTO users (username, password, email, created_at, last_login) VALUES (?, ?, ?, ?, ?)",
+                (username, user['password'], user.get('email'), user.get('created_at'), user.get('last_login'))
+            )
+            conn.execute("DELETE FROM history WHERE username = ?", (username,))
+            _insert_history(conn, username, user.get('history', []))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def _import_json(conn, path, mark=False):
+    """
+    Copy the users of a JSON store that aren't in the database yet, with their
+    history, in one transaction; returns the number of users imported. Users
+    already in the database are left alone, so importing again never
+    overwrites newer passwords or history. With mark, the same transaction
+    records that the store has been imported.
+    """
+    try:
+        with open(path, 'r') as f:
+            users = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        # Missing or corrupted file, nothing to import
+        return 0
+    imported = 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for username, user in users.items():
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO users (username, password, email, created_at, last_login) VALUES (?, ?, ?, ?, ?)",
+                (username, user['password'], user.get('email'), user.get('created_at'), user.get('last_login'))
+            )
+            if cursor.rowcount == 1:
+                _insert_history(conn, username, user.get('history', []))
+                imported += 1
+        if mark:
+            conn.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('json_imported', ?)",
+                         (datetime.now().isoformat(),))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return imported
+
+def migrate_from_json(path=USER_DB_FILE):
+    """Import the users, and their history, of the old JSON store that aren't in the database yet; returns how many"""
+    conn = _connect()
+    try:
+        return _import_json(conn, path)
+    finally:
+        conn.close()
+        _users_changed()
+
+def _store_version():
+    """
+    Changes whenever the store is written, by any process: a commit in WAL
+    mode grows or rewrites the -wal file and a checkpoint rewrites the
+    database, so their mtimes and sizes are compared instead of querying
+    """
+    version = [_local_writes]
+    for path in (USER_DB, USER_DB + "-wal"):
         try:
-            with open(USER_DB_FILE, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            # If file is corrupted, return empty dict
-            return {}
-    return {}
+            stat = os.stat(path)
+            version += [stat.st_mtime_ns, stat.st_size]
+        except FileNotFoundError:
+            version += [None, None]
+    return tuple(version)
+
+def _users_changed():
+    """Note a write to users made by this process"""
+    global _local_writes
+    with _user_cache_lock:
+        _local_writes += 1
+
+def get_user(username):
+    """A user's record without history, or None if there is no such user"""
+    _init_db(os.path.abspath(USER_DB))
+    # Cached records are served while the store is unchanged
+    version = _store_version()
+    with _user_cache_lock:
+        cached = _user_cache.get(username)
+        if cached is not None and cached[0] == version:
+            _user_cache.move_to_end(username)
+            return dict(cached[1]) if cached[1] else None
+    
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT password, email, created_at, last_login FROM users WHERE username = ?", (username,)
+        ).fetchone()
+    finally:
+        conn.close()
+    user = dict(row) if row else None
+    
+    # Stored with the version read before the query, so a write racing the
+    # query only causes a refetch next time
+    with _user_cache_lock:
+        _user_cache[username] = (version, user)
+        _user_cache.move_to_end(username)
+        while len(_user_cache) > USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+    return dict(user) if user else None
+
+def load_users():
+    """
+    Load all users with their history, in the shape the JSON store had.
+    History includes this process's events not compacted yet, and every entry
+    carries its event_id, so saving the users back with save_users never
+    duplicates an event when a history log is compacted later.
+    """
+    pending = _history_writer()._pending()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN")  # one snapshot for all queries
+        users = {row['username']: {**dict(row), 'history': []} for row in conn.execute(
+            "SELECT username, password, email, created_at, last_login FROM users"
+        )}
+        for row in conn.execute(
+            "SELECT username, file_name, description, file_hash, timestamp, event_id FROM history ORDER BY id"
+        ):
+            entry = dict(row)
+            username = entry.pop('username')
+            if username in users:
+                users[username]['history'].append(entry)
+        for event in _unsaved(conn, pending):
+            if event['username'] in users:
+                users[event['username']]['history'].append(
+                    {**{key: event[key] for key in ('file_name', 'description', 'file_hash', 'timestamp')},
+                     'event_id': event['id']}
+                )
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    for user in users.values():
+        del user['username']
+    return users
 
 def save_users(users):
-    """Save users to the JSON file"""
-    with open(USER_DB_FILE, 'w') as f:
-        json.dump(users, f)
+    """Save the given users, replacing their stored records and history"""
+    conn = _connect()
+    try:
+        _write_users(conn, users)
+    finally:
+        conn.close()
+        _users_changed()
 
 def create_user(username, password, email):
     """Create a new user"""
-    users = load_users()
-    
-    # Check if username already exists
-    if username in users:
+    conn = _connect()
+    try:
+        # The primary key rejects a username that already exists
+        conn.execute(
+            "INSERT INTO users (username, password, email, created_at, last_login) VALUES (?, ?, ?, ?, NULL)",
+            (username, hash_password(password), email, datetime.now().isoformat())
+        )
+    except sqlite3.IntegrityError:
         return False, "Username already exists"
-    
-    # Create user record
-    users[username] = {
-        'password': hash_password(password),
-        'email': email,
-        'created_at': datetime.now().isoformat(),
-        'last_login': None,
-        'history': []
-    }
-    
-    save_users(users)
+    finally:
+        conn.close()
+        _users_changed()
     return True, "Account created successfully"
 
 def authenticate(username, password):
     """Authenticate a user"""
-    users = load_users()
+    user = get_user(username)
     
-    if username not in users:
+    if user is None:
         return False, "Invalid username or password"
     
-    hashed_password = hash_password(password)
-    if users[username]['password'] != hashed_password:
+    matches, needs_rehash = verify_password(password, user['password'])
+    if not matches:
         return False, "Invalid username or password"
     
-    # Update last login
-    users[username]['last_login'] = datetime.now().isoformat()
-    save_users(users)
+    # Update last login, upgrading a legacy or weaker hash while we have the password
+    conn = _connect()
+    try:
+        if needs_rehash:
+            conn.execute("UPDATE users SET last_login = ?, password = ? WHERE username = ?",
+                         (datetime.now().isoformat(), hash_password(password), username))
+        else:
+            conn.execute("UPDATE users SET last_login = ? WHERE username = ?", (datetime.now().isoformat(), username))
+    finally:
+        conn.close()
+        _users_changed()
     
     return True, "Login successful"
 
@@ -93,33 +405,280 @@ def get_session_duration():
         return round(delta.total_seconds() / 60)
     return 0
 
-def record_analysis(username, file_name, description):
+class HistoryWriter:
+    """
+    Write-behind history: events are buffered in memory, appended to this
+    process's log in fsynced batches by a background thread, and compacted
+    into the history table. Events that aren't in the table yet are kept in
+    memory so reads can include them.
+    """
+
+    def __init__(self, log_prefix=HISTORY_LOG_PREFIX):
+        self.log_prefix = log_prefix
+        self.log_path = f"{log_prefix}.{uuid.uuid4().hex}.jsonl"
+        self._buffer = []  # recorded, not yet in the log
+        self._logged = []  # in the log, not yet in the table
+        self._lock = threading.Lock()  # guards the two lists
+        self._io_lock = threading.Lock()  # one flush or compaction at a time
+        self._wake = threading.Event()
+        self._closed = False
+        self._last_compaction = time.monotonic()
+        # The log exists from the start, so its mtime shows other processes this one is alive
+        open(self.log_path, 'a').close()
+        self.adopt_orphans()
+        threading.Thread(target=self._run, name="history-writer", daemon=True).start()
+        atexit.register(self.close)
+
+    def record(self, event):
+        """Queue one event; returns without touching the disk"""
+        with self._lock:
+            self._buffer.append(event)
+            if len(self._buffer) >= HISTORY_FLUSH_EVENTS:
+                self._wake.set()
+
+    def _pending(self, username=None):
+        """This process's events (of one user, if given) that weren't compacted into the table when asked"""
+        with self._lock:
+            return [event for event in self._logged + self._buffer if username is None or event['username'] == username]
+
+    def read(self, username):
+        """One user's history, oldest first: the table rows followed by the events not compacted into it yet"""
+        pending = self._pending(username)
+        conn = _connect()
+        try:
+            conn.execute("BEGIN")  # one snapshot for both queries
+            rows = conn.execute(
+                "SELECT file_name, description, file_hash, timestamp FROM history WHERE username = ? ORDER BY id",
+                (username,)
+            ).fetchall()
+            pending = _unsaved(conn, pending)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        history = [dict(row) for row in rows]
+        history.extend({key: event[key] for key in ('file_name', 'description', 'file_hash', 'timestamp')} for event in pending)
+        return history
+
+    def read_page(self, username, cursor, limit):
+        """
+        Up to `limit` entries of one user's history, newest first. Events not
+        compacted yet come first, taken from memory without waiting for the
+        writer, then table rows by descending id from the (username, id)
+        index; each page is ordered by timestamp. Returns (entries, next
+        cursor), the cursor being None after the last page
+        """
+        bound, skip = cursor if cursor is not None else (None, 0)
+        pending = self._pending(username)
+        conn = _connect()
+        try:
+            conn.execute("BEGIN")  # one snapshot for all queries
+            if bound is None:
+                # Rows compacted after the first page stay off the later ones
+                bound = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM history").fetchone()[0]
+            pending = _unsaved(conn, pending)
+            pending.sort(key=lambda event: event['timestamp'], reverse=True)
+            shown = pending[skip:skip + limit]
+            table_slots = limit - len(shown)
+            rows = conn.execute(
+                "SELECT id, file_name, description, file_hash, timestamp FROM history "
+                "WHERE username = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (username, bound, table_slots + 1)
+            ).fetchall()
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        table_entries = [dict(row) for row in rows[:table_slots]]
+        skip += len(shown)
+        if skip < len(pending) or len(rows) > table_slots:
+            next_cursor = (table_entries[-1]['id'] if table_entries else bound, skip)
+        else:
+            next_cursor = None
+        entries = [{'id': None, **{key: event[key] for key in ('file_name', 'description', 'file_hash', 'timestamp')}}
+                   for event in shown]
+        entries.extend(table_entries)
+        entries.sort(key=lambda entry: entry['timestamp'], reverse=True)
+        return entries, next_cursor
+
+    def count(self, username):
+        """Number of history entries of one user: table rows plus events not compacted yet"""
+        pending = self._pending(username)
+        conn = _connect()
+        try:
+            conn.execute("BEGIN")  # one snapshot for both queries
+            count = conn.execute("SELECT COUNT(*) FROM history WHERE username = ?", (username,)).fetchone()[0]
+            pending = _unsaved(conn, pending)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return count + len(pending)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(HISTORY_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self._touch()
+                self.flush()
+                if os.path.getsize(self.log_path) > HISTORY_COMPACT_BYTES \
+                        or time.monotonic() - self._last_compaction > HISTORY_COMPACT_INTERVAL:
+                    self.compact()
+                    self.adopt_orphans()
+            except Exception:
+                # Keep the events and try again on the next round
+                traceback.print_exc()
+
+    def _touch(self):
+        """Refresh the log's mtime, the sign that this process is still alive"""
+        try:
+            os.utime(self.log_path)
+        except FileNotFoundError:
+            # Taken for an orphan after a long stall; what it held is still in memory
+            open(self.log_path, 'a').close()
+
+    def flush(self):
+        """Append buffered events to the log with a single fsync"""
+        with self._io_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return
+            try:
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write("".join(json.dumps(event) + "\n" for event in batch))
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception:
+                with self._lock:
+                    self._buffer[:0] = batch
+                raise
+            with self._lock:
+                self._logged.extend(batch)
+
+    def _insert(self, events):
+        """Add events to the history table in one transaction"""
+        conn = _connect()
+        try:
+            # Events of unknown users are dropped, as before. An event already
+            # in the table is skipped, so replaying a log never duplicates rows
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR IGNORE INTO history (event_id, username, file_name, description, file_hash, timestamp) "
+                "SELECT ?, username, ?, ?, ?, ? FROM users WHERE username = ?",
+                [(event.get('id'), event['file_name'], event['description'], event['file_hash'], event['timestamp'],
+                  event['username'])
+                 for event in events]
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def compact(self):
+        """Move logged events into the history table and empty the log"""
+        with self._io_lock:
+            with self._lock:
+                batch = list(self._logged)
+            if batch:
+                self._insert(batch)
+                # Only this process appends to its log, and flushes hold _io_lock
+                open(self.log_path, 'w').close()
+                with self._lock:
+                    del self._logged[:len(batch)]
+            self._last_compaction = time.monotonic()
+
+    def adopt_orphans(self):
+        """Fold the logs left behind by stopped processes into the history table and delete them"""
+        now = time.time()
+        for path in glob.glob(f"{glob.escape(self.log_prefix)}*.jsonl"):
+            if path == self.log_path:
+                continue
+            try:
+                if now - os.path.getmtime(path) < HISTORY_LOG_STALE_AFTER:
+                    continue  # its process is still running
+                events = _read_log(path)
+            except FileNotFoundError:
+                continue  # adopted by another process meanwhile
+            with self._io_lock:
+                self._insert(events)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """Write everything out and remove the emptied log; called at interpreter exit"""
+        self.flush()
+        self.compact()
+        self._closed = True
+        with self._io_lock, self._lock:
+            if not self._logged and not self._buffer:
+                try:
+                    os.remove(self.log_path)
+                except FileNotFoundError:
+                    pass
+
+def _unsaved(conn, events):
+    """
+    The events that aren't in the history table. Reads take pending events
+    from memory before querying, so a compaction in between shows up here
+    rather than as a missing or doubled entry
+    """
+    ids = [event['id'] for event in events if event.get('id')]
+    saved = set()
+    if ids:
+        saved = {row[0] for row in conn.execute(
+            f"SELECT event_id FROM history WHERE event_id IN ({', '.join('?' * len(ids))})", ids
+        )}
+    return [event for event in events if event.get('id') not in saved]
+
+def _read_log(path):
+    """Events in a history log, skipping a torn last line"""
+    events = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return events
+
+@functools.lru_cache(maxsize=1)
+def _history_writer():
+    return HistoryWriter()
+
+def record_analysis(username, file_name, description, file_hash=None):
     """Record an analysis in the user's history"""
-   
-    
-    users = load_users()
-    
-    if username in users:
-        # Add the analysis to the user's history
-        users[username]['history'].append({
-            'file_name': file_name,
-            'description': description,
-            'timestamp': datetime.now().isoformat()
-        })
-        
-        save_users(users)
+    # Add the analysis to the user's history; file_hash lets the chat be
+    # reopened from the account's chat store. Written behind, see HistoryWriter
+    _history_writer().record({
+        'id': uuid.uuid4().hex,
+        'username': username,
+        'file_name': file_name,
+        'description': description,
+        'file_hash': file_hash,
+        'timestamp': datetime.now().isoformat()
+    })
 
 def get_user_history(username):
     """Get the analysis history for a user"""
+    history = _history_writer().read(username)
     
+    # Convert ISO timestamps to datetime objects
+    for entry in history:
+        entry['timestamp'] = datetime.fromisoformat(entry['timestamp'])
+    return history
+
+def get_user_history_page(username, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """
+    One page of a user's analysis history, newest first. Pass the returned
+    cursor to get the next page; it is None after the last page.
+    """
+    entries, next_cursor = _history_writer().read_page(username, cursor, limit)
     
-    users = load_users()
-    
-    if username in users and 'history' in users[username]:
-        # Convert ISO timestamps to datetime objects
-        history = users[username]['history']
-        for entry in history:
-            entry['timestamp'] = datetime.fromisoformat(entry['timestamp'])
-        return history
-    
-    return []
\ No newline at end of file
+    # Convert ISO timestamps to datetime objects
+    for entry in entries:
+        entry['timestamp'] = datetime.fromisoformat(entry['timestamp'])
+    return entries, next_cursor
+
+def count_user_history(username):
+    """Number of analyses in a user's history"""
+    return _history_writer().count(username)
@@ -0,0 +1,491 @@
+"""
+Micro-benchmarks for the chat analysis pipeline.
+
+Run with:  python benchmark.py [number_of_messages]
+
+A synthetic Android-style export is generated in memory, so no real chat
+data is needed. Each benchmark compares the current implementation in
+functions.py with the reference implementation it replaced.
+"""
+import asyncio
+import io
+import random
+import re
+import socket
+import sys
+import time
+
+import pandas as pd
+
+import functions
+import email_util
+
+
+SAMPLE_USERS = ["Asha", "Bhoomika", "Chetan", "Deepa", "+91 98450 12345"]
+SAMPLE_BODIES = [
+    "hi how are you",
+    "<Media omitted>",
+    "This message was deleted",
+    "see https://example.com/some/page for details",
+    "ok 👍",
+    "haha 😂😂 that was great",
+    "family 👨‍👩‍👧 trip 🇮🇳 👍🏽",
+    "first line\nsecond line\nthird line",
+]
+
+
+def make_chat(n_messages, seed=0):
+    """Build a synthetic WhatsApp export with n_messages messages"""
+    rng = random.Random(seed)
+    lines = []
+    ts = pd.Timestamp("2021-01-01 08:00")
+    for _ in range(n_messages):
+        ts += pd.Timedelta(minutes=rng.randint(0, 5))
+        header = f"{ts.day}/{ts.month}/{ts.strftime('%y')}, {ts.strftime('%I:%M')} {ts.strftime('%p').lower()} - "
+        if rng.random() < 0.02:
+            lines.append(header + "Asha added Deepa")
+        else:
+            lines.append(header + rng.choice(SAMPLE_USERS) + ": " + rng.choice(SAMPLE_BODIES))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def legacy_generateDataFrame(file):
+    """The original double-scan regex parser, kept as a reference"""
+    data = file.read().decode("utf-8")
+    data = data.replace('\u202f', ' ')
+    data = data.replace('\n', ' ')
+    dt_format = r'\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s?(?:AM\s|PM\s|am\s|pm\s)?-\s'
+    msgs = re.split(dt_format, data)[1:]
+    date_times = re.findall(dt_format, data)
+    date = []
+    time_ = []
+    for dt in date_times:
+        date.append(re.search(r'\d{1,2}/\d{1,2}/\d{2,4}', dt).group())
+        time_.append(re.search(r'\d{1,2}:\d{2}\s?(?:AM|PM|am|pm)?', dt).group())
+    users = []
+    message = []
+    for m in msgs:
+        s = re.split(r'([\w\W]+?):\s', m)
+        if (len(s) < 3):
+            users.append("Notifications")
+            message.append(s[0])
+        else:
+            users.append(s[1])
+            message.append(s[2])
+    return pd.DataFrame(list(zip(date, time_, users, message)), columns=["Date", "Time(U)", "User", "Message"])
+
+
+def legacy_PreProcess(df, dayf):
+    """The original per-row PreProcess, kept as a reference"""
+    df['Date'] = pd.to_datetime(df['Date'], dayfirst=dayf)
+    df['Time'] = pd.to_datetime(df['Time(U)']).dt.time
+    df['year'] = df['Date'].apply(lambda x: int(str(x)[:4]))
+    df['month'] = df['Date'].apply(lambda x: int(str(x)[5:7]))
+    df['date'] = df['Date'].apply(lambda x: int(str(x)[8:10]))
+    df['day'] = df['Date'].apply(lambda x: x.day_name())
+    df['hour'] = df['Time'].apply(lambda x: int(str(x)[:2]))
+    df['month_name'] = df['Date'].apply(lambda x: x.month_name())
+    return df
+
+
+def legacy_getStats(df):
+    """The original getStats, which drops rows from its input, kept as a reference"""
+    import urlextract
+    media = df[df['Message'] == "<Media omitted>"]
+    media_cnt = media.shape[0]
+    df.drop(media.index, inplace=True)
+    deleted_msgs = df[df['Message'] == "This message was deleted"]
+    deleted_msgs_cnt = deleted_msgs.shape[0]
+    df.drop(deleted_msgs.index, inplace=True)
+    temp = df[df['User'] == 'Notifications']
+    df.drop(temp.index, inplace=True)
+    extractor = urlextract.URLExtract()
+    links = []
+    for msg in df['Message']:
+        x = extractor.find_urls(msg)
+        if x:
+            links.extend(x)
+    links_cnt = len(links)
+    word_list = []
+    for msg in df['Message']:
+        word_list.extend(msg.split())
+    word_count = len(word_list)
+    msg_count = df.shape[0]
+    return df, media_cnt, deleted_msgs_cnt, links_cnt, word_count, msg_count
+
+
+def legacy_getEmoji(df):
+    """The original per-character getEmoji, kept as a reference"""
+    import emoji
+    from collections import Counter
+    emojis = []
+    for message in df['Message']:
+        emojis.extend([c for c in message if c in emoji.EMOJI_DATA])
+    return pd.DataFrame(Counter(emojis).most_common(len(Counter(emojis))))
+
+
+def legacy_calculate_response_times(df):
+    """The original row-by-row response time analysis, kept as a reference"""
+    import pandas as pd
+    import numpy as np
+    from datetime import datetime, timedelta
+    
+    # Make sure df is sorted chronologically
+    df = df.sort_values(by=['Date', 'Time'])
+    
+    # Create a datetime column for accurate time difference calculation
+    df['DateTime'] = pd.to_datetime(df['Date'].astype(str) + ' ' + df['Time'].astype(str))
+    
+    # Initialize lists to store response data
+    responding_user = []
+    initiating_user = []
+    response_times = []
+    
+    # Iterate through messages to calculate response times
+    for i in range(1, len(df)):
+        current_user = df.iloc[i]['User']
+        previous_user = df.iloc[i-1]['User']
+        
+        # Only calculate response time when the sender changes
+        if current_user != previous_user:
+            time_diff = (df.iloc[i]['DateTime'] - df.iloc[i-1]['DateTime']).total_seconds() / 60  # in minutes
+            
+            # Filter out unreasonably long response times (e.g., more than 24 hours)
+            if time_diff <= 24 * 60:  # 24 hours in minutes
+                responding_user.append(current_user)
+                initiating_user.append(previous_user)
+                response_times.append(time_diff)
+    
+    # Create DataFrame with all response times
+    response_times_df = pd.DataFrame({
+        'Responder': responding_user,
+        'Initiator': initiating_user,
+        'ResponseTime_Minutes': response_times
+    })
+    
+    # Calculate statistics for each user
+    user_stats = []
+    
+    # Get unique users excluding 'Notifications'
+    unique_users = df['User'].unique()
+    unique_users = [user for user in unique_users if user != 'Notifications']
+    
+    for user in unique_users:
+        # Get responses by this user
+        user_responses = response_times_df[response_times_df['Responder'] == user]
+        
+        if not user_responses.empty:
+            avg_time = user_responses['ResponseTime_Minutes'].mean()
+            median_time = user_responses['ResponseTime_Minutes'].median()
+            max_time = user_responses['ResponseTime_Minutes'].max()
+            min_time = user_responses['ResponseTime_Minutes'].min()
+            response_count = len(user_responses)
+            
+            # Calculate responsiveness percentage
+            total_responses_to_user = len(response_times_df[response_times_df['Initiator'] == user])
+            total_messages_to_user = total_responses_to_user  # Simplified metric
+            
+            responsiveness = 0 if total_messages_to_user == 0 else (response_count / total_messages_to_user) * 100
+            
+            user_stats.append({
+                'User': user,
+                'Avg_Response_Time_Min': round(avg_time, 2),
+                'Median_Response_Time_Min': round(median_time, 2),
+                'Max_Response_Time_Min': round(max_time, 2),
+                'Min_Response_Time_Min': round(min_time, 2),
+                'Response_Count': response_count,
+                'Responsiveness': round(responsiveness, 2)
+            })
+    
+    # Create DataFrame with user statistics
+    user_response_stats_df = pd.DataFrame(user_stats)
+    
+    return response_times_df, user_response_stats_df
+
+
+def legacy_build_message(email_config, recipient_email, pdf_buffer, filename, user_name=None):
+    """The original in-memory MIME message, kept as a reference"""
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.base import MIMEBase
+    from email.mime.text import MIMEText
+    from email.utils import formatdate
+    from email import encoders
+    msg = MIMEMultipart()
+    msg['From'] = email_config['sender_email']
+    msg['To'] = recipient_email
+    msg['Date'] = formatdate(localtime=True)
+    msg['Subject'] = "Your WhatsApp Chat Analysis Report"
+    greeting = f"Hello {user_name}" if user_name else "Hello"
+    msg.attach(MIMEText(f"{greeting},\n\nAttached is your WhatsApp Chat Analysis Report.\n", 'plain'))
+    pdf_buffer.seek(0)
+    attachment = MIMEBase('application', 'pdf')
+    attachment.set_payload(pdf_buffer.read())
+    encoders.encode_base64(attachment)
+    attachment.add_header('Content-Disposition', f'attachment; filename="{filename}"')
+    msg.attach(attachment)
+    return msg
+
+
+def legacy_send_pdf_report(email_config, recipient_email, pdf_buffer, filename, user_name=None):
+    """The original connect-login-send-quit per email, kept as a reference"""
+    import smtplib
+    msg = legacy_build_message(email_config, recipient_email, pdf_buffer, filename, user_name)
+    server = smtplib.SMTP(email_config['smtp_server'], email_config['smtp_port'])
+    if email_config['smtp_starttls']:
+        server.starttls()
+    server.login(email_config['sender_email'], email_config['sender_password'])
+    server.send_message(msg)
+    server.quit()
+    return True, "Report sent successfully to your email address!"
+
+
+def local_smtp_server(latency=0.0):
+    """
+    Start an aiosmtpd stand-in that accepts any login and takes `latency`
+    seconds per message, like a remote provider; returns (controller, config,
+    received messages)
+    """
+    from aiosmtpd.controller import Controller
+    from aiosmtpd.smtp import AuthResult
+
+    class Sink:
+        def __init__(self):
+            self.received = []
+
+        async def handle_DATA(self, server, session, envelope):
+            await asyncio.sleep(latency)
+            self.received.append(envelope.rcpt_tos)
+            return "250 OK"
+
+    import logging
+    logging.getLogger("mail.log").setLevel(logging.ERROR)  # aiosmtpd logs every connection
+
+    # Controller needs a concrete port, so borrow a free one from the OS
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    sink = Sink()
+    controller = Controller(sink, hostname="127.0.0.1", port=port, auth_require_tls=False,
+                            authenticator=lambda *args: AuthResult(success=True))
+    controller.start()
+    config = {
+        'smtp_server': "127.0.0.1",
+        'smtp_port': port,
+        'sender_email': "reports@example.com",
+        'sender_password': "secret",
+        'smtp_starttls': False,
+        'smtp_timeout': 10.0,
+    }
+    return controller, config, sink.received
+
+
+def legacy_record_analysis(path, username, file_name, description):
+    """The original load-append-rewrite of the whole JSON user store, kept as a reference"""
+    import json
+    from datetime import datetime
+    with open(path) as f:
+        users = json.load(f)
+    users[username]['history'].append({'file_name': file_name, 'description': description,
+                                       'timestamp': datetime.now().isoformat()})
+    with open(path, 'w') as f:
+        json.dump(users, f)
+
+
+def timed(func, *args, repeat=3):
+    """Return (best wall time in seconds, result of the last call)"""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_parser(chat):
+    old_t, old_df = timed(lambda: legacy_generateDataFrame(io.BytesIO(chat)))
+    new_t, new_df = timed(lambda: functions.generateDataFrame(io.BytesIO(chat)))
+    assert len(old_df) == len(new_df), "parsers disagree on message count"
+    assert old_df['User'].tolist() == new_df['User'].tolist(), "parsers disagree on senders"
+    print(f"generateDataFrame  legacy {old_t:8.3f}s   current {new_t:8.3f}s   x{old_t / new_t:5.1f}")
+
+
+def bench_preprocess(chat):
+    df = functions.generateDataFrame(io.BytesIO(chat))
+    old_t, old_df = timed(lambda: legacy_PreProcess(df.copy(), True))
+    new_t, new_df = timed(lambda: functions.PreProcess(df.copy(), True))
+    for col in ['Date', 'year', 'month', 'date', 'hour']:
+        assert (old_df[col] == new_df[col]).all(), f"PreProcess disagrees on {col}"
+    assert (old_df['day'] == new_df['day'].astype(str)).all(), "PreProcess disagrees on day"
+    print(f"PreProcess         legacy {old_t:8.3f}s   current {new_t:8.3f}s   x{old_t / new_t:5.1f}")
+
+
+def bench_stats(chat):
+    df = functions.PreProcess(functions.generateDataFrame(io.BytesIO(chat)))
+    old_t, old = timed(lambda: legacy_getStats(df.copy()), repeat=1)
+    new_t, new = timed(lambda: functions.getStats(df))
+    assert old[1:] == new[1:], "getStats counters disagree"
+    assert old[0].index.equals(new[0].index), "getStats keeps different rows"
+    print(f"getStats           legacy {old_t:8.3f}s   current {new_t:8.3f}s   x{old_t / new_t:5.1f}")
+
+
+def bench_emoji(chat):
+    df = functions.generateDataFrame(io.BytesIO(chat))
+    mb = df['Message'].str.len().sum() / 1e6
+    functions.getEmoji(df.head())  # build the emoji regexes outside the timing
+    old_t, _ = timed(lambda: legacy_getEmoji(df))
+    new_t, new = timed(lambda: functions.getEmoji(df))
+    assert "👨‍👩‍👧" in set(new[0]), "ZWJ sequence not kept whole"
+    print(f"getEmoji           legacy {mb / old_t:6.1f}MB/s current {mb / new_t:6.1f}MB/s x{old_t / new_t:5.1f}")
+
+
+def bench_response_times(chat):
+    # The reference implementation is quadratic-ish, so keep the sample small
+    df = functions.getTextMessages(functions.PreProcess(functions.generateDataFrame(io.BytesIO(chat)))).head(20000)
+    old_t, old = timed(lambda: legacy_calculate_response_times(df), repeat=1)
+    new_t, new = timed(lambda: functions.calculate_response_times(df))
+    pd.testing.assert_frame_equal(old[0], new[0])
+    pd.testing.assert_frame_equal(old[1], new[1])
+    print(f"response times     legacy {old_t:8.3f}s   current {new_t:8.3f}s   x{old_t / new_t:5.1f}  ({len(df)} messages)")
+
+
+def bench_pdf_profiles(chat):
+    raw = functions.PreProcess(functions.generateDataFrame(io.BytesIO(chat)))
+    df = functions.getTextMessages(raw)
+    analysis = functions.build_analysis(df, "Everyone", functions.buildUserIndex(raw)["Everyone"])
+    for profile in functions.PDF_PROFILES:
+        seconds, buffer = timed(functions.generate_analysis_report, analysis, True, profile, repeat=1)
+        print(f"PDF {profile:<14} {buffer.getbuffer().nbytes / 1e6:8.2f}MB   {seconds:8.3f}s")
+
+
+def bench_email_memory(pdf_mb=20):
+    """Peak memory allocated while serialising one report email, on top of the PDF itself"""
+    import email
+    import tracemalloc
+    config = {'sender_email': "reports@example.com"}
+    pdf = io.BytesIO(random.Random(0).randbytes(pdf_mb * 1_000_000))
+
+    def legacy():
+        return legacy_build_message(config, "user@example.com", pdf, "report.pdf").as_bytes()
+
+    def streamed():
+        for chunk in email_util._iter_message_bytes(config, "user@example.com", pdf, "report.pdf"):
+            pass
+
+    peaks = []
+    for func in (legacy, streamed):
+        tracemalloc.start()
+        func()
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1e6)
+        tracemalloc.stop()
+    message = email.message_from_bytes(b"".join(email_util._iter_message_bytes(config, "user@example.com", pdf, "report.pdf")))
+    assert message.get_payload()[1].get_payload(decode=True) == pdf.getvalue(), "attachment does not round-trip"
+    print(f"email {pdf_mb}MB PDF peak legacy {peaks[0]:6.1f}MB   current {peaks[1]:6.1f}MB")
+
+
+def bench_email(n_reports=50, latency=0.02):
+    try:
+        controller, config, received = local_smtp_server(latency)
+    except ImportError:
+        print("email              skipped (pip install aiosmtpd)")
+        return
+    try:
+        pdf = io.BytesIO(b"%PDF-1.4 " + bytes(200_000))
+        reports = [(f"user{i}@example.com", pdf, "report.pdf", f"user{i}") for i in range(n_reports)]
+        old_t, _ = timed(lambda: [legacy_send_pdf_report(config, *report) for report in reports], repeat=1)
+        pool = email_util.SMTPConnectionPool(config)
+        new_t, results = timed(lambda: email_util.send_pdf_reports(reports, pool=pool), repeat=1)
+        pool.close_all()
+        assert all(success for success, _ in results), results
+        assert len(received) == 2 * n_reports, "not every email arrived"
+        print(f"email x{n_reports:<9} legacy {old_t:8.3f}s   current {new_t:8.3f}s   x{old_t / new_t:5.1f}")
+        async_t, results = timed(lambda: asyncio.run(email_util.send_pdf_reports_async(reports, email_config=config)), repeat=1)
+        assert all(result['success'] for result in results), results
+        assert len(received) == 3 * n_reports, "not every email arrived"
+        print(f"email async x{n_reports:<3} legacy {old_t:8.3f}s   current {async_t:8.3f}s   x{old_t / async_t:5.1f}")
+    finally:
+        controller.stop()
+
+
+def bench_history(n_users=1000, n_events=2000):
+    """Cost of recording one history event, in a scratch directory"""
+    import json
+    import os
+    import tempfile
+    import auth
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            users = {f"user{i}": {'password': "x", 'email': f"user{i}@example.com", 'created_at': None,
+                                  'last_login': None, 'history': [{'file_name': "chat.txt", 'description': "Analysis",
+                                                                   'timestamp': "2024-01-01T00:00:00"}] * 20}
+                     for i in range(n_users)}
+            with open(auth.USER_DB_FILE, 'w') as f:
+                json.dump(users, f)
+            auth.get_user("user0")  # migrate the JSON store outside the timing
+
+            old_t, _ = timed(lambda: [legacy_record_analysis(auth.USER_DB_FILE, "user0", "chat.txt", "Analysis")
+                                      for _ in range(n_events // 20)], repeat=1)
+            new_t, _ = timed(lambda: [auth.record_analysis("user0", "chat.txt", "Analysis") for _ in range(n_events)], repeat=1)
+            auth._history_writer().close()
+            assert len(auth.get_user_history("user0")) == 20 + n_events, "history events lost"
+            old_us, new_us = old_t / (n_events // 20) * 1e6, new_t / n_events * 1e6
+            print(f"record_analysis    legacy {old_us:8.1f}us  current {new_us:8.1f}us  x{old_us / new_us:5.0f}  ({n_users} users)")
+
+            # Looking up the logged-in user's email, as main.py does before sending a report
+            def legacy_lookup():
+                with open(auth.USER_DB_FILE) as f:
+                    return json.load(f)["user1"]['email']
+            old_t, _ = timed(lambda: [legacy_lookup() for _ in range(20)], repeat=1)
+            new_t, _ = timed(lambda: [auth.get_user("user1")['email'] for _ in range(n_events)], repeat=1)
+            old_us, new_us = old_t / 20 * 1e6, new_t / n_events * 1e6
+            print(f"user lookup        legacy {old_us:8.1f}us  current {new_us:8.1f}us  x{old_us / new_us:5.0f}  ({n_users} users)")
+        finally:
+            os.chdir(cwd)
+
+
+def bench_password_hashing(threads=(1, 4, 16), logins=64):
+    """Login latency at the calibrated work factor and logins per second under concurrent load, in a scratch directory"""
+    import os
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    import auth
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            iterations = auth.calibrate_password_iterations(auth.PASSWORD_HASH_TARGET_MS / 1000)
+            stored = auth.hash_password("correct horse", iterations)
+            latency, _ = timed(lambda: auth.verify_password("correct horse", stored), repeat=5)
+            print(f"password hash      {iterations} iterations {latency * 1000:6.1f}ms per login")
+            for n_threads in threads:
+                with ThreadPoolExecutor(n_threads) as pool:
+                    elapsed, _ = timed(lambda: list(pool.map(lambda _: auth.verify_password("correct horse", stored),
+                                                             range(logins))), repeat=1)
+                print(f"password hash      {n_threads:2d} threads {logins / elapsed:8.1f} logins/s")
+        finally:
+            os.chdir(cwd)
+
+
+def main():
+    n_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    chat = make_chat(n_messages)
+    print(f"{n_messages} messages, {len(chat) / 1e6:.1f} MB")
+    bench_parser(chat)
+    bench_preprocess(chat)
+    bench_stats(chat)
+    bench_emoji(chat)
+    bench_response_times(chat)
+    bench_pdf_profiles(chat)
+    bench_history()
+    bench_password_hashing()
+    bench_email_memory()
+    bench_email()
+
+
+if __name__ == "__main__":
+    main()
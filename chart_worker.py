@@ -0,0 +1,21 @@
+import multiprocessing.spawn
+
+import matplotlib
+
+# Preloaded by the forkserver that PDF chart workers are forked from (see
+# functions._chart_pool), so the chart code is imported once and workers
+# start from a clean, single-threaded process.
+
+# Workers only ever render off-screen
+matplotlib.use('Agg')
+
+import functions  # noqa: E402
+
+# multiprocessing normally re-runs the parent's __main__ in every worker so
+# pickled references into it resolve. Under Streamlit that is the app script
+# itself, and chart jobs only reference this module and functions, so the
+# forked workers skip it. The hook is private, so it is only replaced on the
+# Python versions it was checked on; elsewhere the app renders charts
+# serially and never starts this forkserver
+if functions._chart_pool_supported():
+    multiprocessing.spawn._fixup_main_from_path = lambda main_path: None
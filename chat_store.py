@@ -0,0 +1,77 @@
+import os
+import re
+import json
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# Parsed chats are kept per account as uncompressed Feather (Arrow IPC) files,
+# keyed by the hash of the uploaded export, so a repeat upload or a reopen
+# from the history panel memory-maps the columns back instead of re-parsing
+STORE_DIR = os.path.join("user_data", "chat_cache")
+MAX_BYTES_PER_USER = 512 * 1024 * 1024
+
+def _user_dir(username):
+    """Directory holding one account's stored chats"""
+    return os.path.join(STORE_DIR, re.sub(r'[^\w.-]', '_', username))
+
+def _chat_path(username, digest):
+    """File for one chat, as parsed with the detected day/month order"""
+    return os.path.join(_user_dir(username), f"{digest}.feather")
+
+def has_chat(username, digest):
+    """Check whether a chat is stored for this account"""
+    return os.path.exists(_chat_path(username, digest))
+
+def load_chat(username, digest):
+    """Memory-map a stored chat back into a DataFrame, or return None if it isn't stored"""
+    path = _chat_path(username, digest)
+    try:
+        table = feather.read_table(path, memory_map=True)
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+
+    # Mark as recently used so eviction keeps it
+    os.utime(path)
+
+    df = table.to_pandas()
+    attrs = json.loads((table.schema.metadata or {}).get(b'attrs', b'{}'))
+    df.attrs.update({k: tuple(v) if isinstance(v, list) else v for k, v in attrs.items()})
+    return df
+
+def save_chat(username, digest, df):
+    """Store a parsed chat for this account, evicting old ones beyond the size cap"""
+    path = _chat_path(username, digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'attrs'] = json.dumps(df.attrs).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    # Write to a temp file first so a reader never maps a half-written file
+    tmp_path = path + '.tmp'
+    feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+
+    evict(username, keep=path)
+
+def evict(username, keep=None):
+    """Delete least recently used chats until the account is under MAX_BYTES_PER_USER"""
+    user_dir = _user_dir(username)
+    if not os.path.isdir(user_dir):
+        return
+
+    entries = []
+    for name in os.listdir(user_dir):
+        if name.endswith('.feather'):
+            stat = os.stat(os.path.join(user_dir, name))
+            entries.append((stat.st_mtime, stat.st_size, os.path.join(user_dir, name)))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= MAX_BYTES_PER_USER:
+            break
+        if path == keep:
+            continue
+        os.remove(path)
+        total -= size
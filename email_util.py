@@ -1,10 +1,18 @@
 import os
+import time
+import uuid
+import base64
+import asyncio
 import smtplib
-from email.mime.multipart import MIMEMultipart
+import functools
+import threading
+from contextlib import contextmanager
 from email.mime.base import MIMEBase
 from email.mime.text import MIMEText
+from email.message import Message
 from email.utils import formatdate
-from email import encoders
+from email import policy
+import aiosmtplib
 import dotenv
 import streamlit as st
 
@@ -16,11 +24,232 @@ def load_email_config():
         'smtp_server': os.getenv('SMTP_SERVER', 'smtp.gmail.com'),
         'smtp_port': int(os.getenv('SMTP_PORT', 587)),
         'sender_email': os.getenv('SENDER_EMAIL'),
-        'sender_password': os.getenv('SENDER_PASSWORD')
+        'sender_password': os.getenv('SENDER_PASSWORD'),
+        'smtp_starttls': os.getenv('SMTP_STARTTLS', 'true').lower() != 'false',
+        'smtp_timeout': float(os.getenv('SMTP_TIMEOUT', 30))
     }
     
     return email_config
 
+@functools.lru_cache(maxsize=1)
+def get_email_config():
+    """Email configuration, loaded once per process"""
+    return load_email_config()
+
+_LOGIN_REQUIRED = "The SMTP server requires a login but no sender password is configured"
+
+# Connections kept open for reuse, which also caps concurrent sessions to
+# stay under provider rate limits
+SMTP_POOL_SIZE = 4
+# Idle connections older than this are closed instead of reused
+SMTP_IDLE_TIMEOUT = 120
+# Idle connections older than this are checked with NOOP before reuse
+SMTP_NOOP_AFTER = 10
+
+def _is_connection_error(e):
+    """Whether an error means the connection itself is gone (SMTPException subclasses OSError too)"""
+    if isinstance(e, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    return isinstance(e, OSError) and not isinstance(e, smtplib.SMTPException)
+
+class SMTPConnectionPool:
+    """Thread-safe pool of logged-in SMTP connections"""
+
+    def __init__(self, config, size=SMTP_POOL_SIZE):
+        self.config = config
+        self._idle = []  # (connection, last used)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _open(self):
+        """Connect, upgrade to TLS and log in if the server asks for it"""
+        server = smtplib.SMTP(self.config['smtp_server'], self.config['smtp_port'], timeout=self.config['smtp_timeout'])
+        try:
+            if self.config['smtp_starttls']:
+                server.starttls()  # Secure the connection
+            # Relays without AUTH (e.g. a local one) are used without credentials
+            server.ehlo_or_helo_if_needed()
+            if server.has_extn('auth'):
+                if not self.config['sender_password']:
+                    raise smtplib.SMTPAuthenticationError(530, _LOGIN_REQUIRED)
+                server.login(self.config['sender_email'], self.config['sender_password'])
+        except Exception:
+            _close(server)
+            raise
+        return server
+
+    def _checkout(self):
+        """An idle connection that is still alive, or a new one"""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, last_used = self._idle.pop()
+            idle = time.monotonic() - last_used
+            if idle > SMTP_IDLE_TIMEOUT:
+                _close(server)
+            elif idle > SMTP_NOOP_AFTER and not _is_alive(server):
+                _close(server)
+            else:
+                return server
+        return self._open()
+
+    def _checkin(self, server):
+        with self._lock:
+            self._idle.append((server, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for one or more sends. A connection left in an
+        unknown state by an error is dropped instead of going back to the pool.
+        """
+        with self._slots:
+            lease = _Lease(self, self._checkout())
+            try:
+                yield lease
+            except Exception:
+                _close(lease.server)
+                raise
+            self._checkin(lease.server)
+
+    def close_all(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            _close(server)
+
+class _Lease:
+    """A borrowed connection that reconnects once if the server dropped it"""
+
+    def __init__(self, pool, server):
+        self.pool = pool
+        self.server = server
+
+    def send(self, sender, recipient, make_chunks):
+        """Stream one message; make_chunks() must return a fresh chunk iterator each call"""
+        try:
+            _stream_message(self.server, sender, recipient, make_chunks())
+            return
+        except OSError as e:
+            if not _is_connection_error(e):
+                raise
+            _close(self.server)
+        self.server = self.pool._open()
+        _stream_message(self.server, sender, recipient, make_chunks())
+
+def _is_alive(server):
+    """Check a connection with NOOP"""
+    try:
+        return server.noop()[0] == 250
+    except OSError:
+        return False
+
+def _close(server):
+    """Quit a connection, ignoring a server that already went away"""
+    try:
+        server.quit()
+    except Exception:
+        server.close()
+
+@functools.lru_cache(maxsize=1)
+def get_smtp_pool():
+    """The process-wide pool, using get_email_config()"""
+    return SMTPConnectionPool(get_email_config())
+
+# Raw attachment bytes per base64 chunk; a multiple of 57 so every chunk
+# encodes to whole 76-character lines
+ATTACHMENT_CHUNK_BYTES = 57 * 1024
+
+def _iter_message_bytes(email_config, recipient_email, pdf_buffer, filename, user_name=None):
+    """
+    The report email with the PDF attached, as CRLF-terminated chunks that
+    each start at a line boundary. The attachment is base64-encoded one chunk
+    at a time, so the whole encoded message never exists in memory.
+    """
+    boundary = f"==============={uuid.uuid4().hex}=="
+    
+    # Message headers
+    msg = Message(policy=policy.SMTP)
+    msg['From'] = email_config['sender_email']
+    msg['To'] = recipient_email
+    msg['Date'] = formatdate(localtime=True)
+    msg['Subject'] = f"Your WhatsApp Chat Analysis Report"
+    msg['MIME-Version'] = "1.0"
+    msg['Content-Type'] = f'multipart/mixed; boundary="{boundary}"'
+    msg.set_payload("")
+    yield msg.as_bytes()
+    
+    # Email body
+    greeting = f"Hello {user_name}" if user_name else "Hello"
+    body = f"""{greeting},
+
+Attached is your WhatsApp Chat Analysis Report that you requested from my analysis tool.
+
+Thank you for using my service!
+-Bhoomika 
+
+"""
+    text = MIMEText(body, 'plain', policy=policy.SMTP)
+    del text['MIME-Version']
+    yield f"--{boundary}\r\n".encode() + text.as_bytes() + b"\r\n"
+    
+    # Attach the PDF
+    attachment = MIMEBase('application', 'pdf', policy=policy.SMTP)
+    del attachment['MIME-Version']
+    attachment['Content-Transfer-Encoding'] = 'base64'
+    attachment.add_header('Content-Disposition', 'attachment', filename=filename)
+    attachment.set_payload("")
+    yield f"--{boundary}\r\n".encode() + attachment.as_bytes()
+    pdf_buffer.seek(0)  # Reset buffer pointer to the beginning
+    while True:
+        chunk = pdf_buffer.read(ATTACHMENT_CHUNK_BYTES)
+        if not chunk:
+            break
+        yield base64.encodebytes(chunk).replace(b"\n", b"\r\n")
+    yield f"--{boundary}--\r\n".encode()
+
+def _stream_message(server, sender, recipient, chunks):
+    """Send a message chunk by chunk over an smtplib connection instead of flattening it first"""
+    server.ehlo_or_helo_if_needed()
+    in_data = False
+    try:
+        code, response = server.mail(sender)
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, response, sender)
+        code, response = server.rcpt(recipient)
+        if code not in (250, 251):
+            raise smtplib.SMTPRecipientsRefused({recipient: (code, response)})
+        server.putcmd("data")
+        code, response = server.getreply()
+        if code != 354:
+            raise smtplib.SMTPDataError(code, response)
+        in_data = True
+        for chunk in chunks:
+            # Every chunk starts a line, so only line starts need dot-stuffing
+            chunk = chunk.replace(b"\r\n.", b"\r\n..")
+            if chunk.startswith(b"."):
+                chunk = b"." + chunk
+            server.send(chunk)
+        server.send(b".\r\n")
+        in_data = False
+        code, response = server.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, response)
+    except Exception:
+        # Leave the connection ready for the next message. Mid-DATA the server
+        # would read any command as message text, so the connection is closed
+        # (the next send reconnects); otherwise the transaction is reset
+        if in_data:
+            server.close()
+        else:
+            try:
+                server.rset()
+            except OSError:
+                server.close()
+        raise
+
 def send_pdf_report(recipient_email, pdf_buffer, filename, user_name=None):
     """
     Send the PDF report to the specified email address
@@ -33,55 +262,164 @@ def send_pdf_report(recipient_email, pdf_buffer, filename, user_name=None):
     
     Returns:
         tuple: (success, message)
+    
+    Raises:
+        smtplib.SMTPAuthenticationError: the login was refused, or the server
+            requires one and no sender password is configured
+    """
+    return send_pdf_reports([(recipient_email, pdf_buffer, filename, user_name)])[0]
+
+def send_pdf_reports(reports, pool=None):
+    """
+    Send many PDF reports over a single pooled, logged-in SMTP session
+    
+    Args:
+        reports (iterable): (recipient_email, pdf_buffer, filename, user_name) tuples
+        pool (SMTPConnectionPool, optional): Defaults to get_smtp_pool()
+    
+    Returns:
+        list: a (success, message) tuple per report, in order
+    
+    Raises:
+        smtplib.SMTPAuthenticationError: the login was refused, or the server
+            requires one and no sender password is configured; no report
+            can be sent until the configuration is fixed
     """
+    reports = list(reports)
+    pool = pool or get_smtp_pool()
+    email_config = pool.config
+    
+    if not email_config['sender_email']:
+        return [(False, "Email configuration is missing. Please contact the administrator.")] * len(reports)
+    
+    results = []
     try:
-        email_config = load_email_config()
-        
-        if not email_config['sender_email'] or not email_config['sender_password']:
-            return False, "Email configuration is missing. Please contact the administrator."
-        
-        # Create message container
-        msg = MIMEMultipart()
-        msg['From'] = email_config['sender_email']
-        msg['To'] = recipient_email
-        msg['Date'] = formatdate(localtime=True)
-        msg['Subject'] = f"Your WhatsApp Chat Analysis Report"
-        
-        # Email body
-        greeting = f"Hello {user_name}" if user_name else "Hello"
-        body = f"""{greeting},
+        with pool.connection() as connection:
+            for recipient_email, pdf_buffer, filename, user_name in reports:
+                try:
+                    connection.send(
+                        email_config['sender_email'],
+                        recipient_email,
+                        lambda: _iter_message_bytes(email_config, recipient_email, pdf_buffer, filename, user_name)
+                    )
+                    results.append((True, "Report sent successfully to your email address!"))
+                except Exception as e:
+                    if _is_connection_error(e) or isinstance(e, smtplib.SMTPAuthenticationError):
+                        raise
+                    # e.g. a refused recipient; the session is still usable
+                    results.append((False, f"Failed to send email: {str(e)}"))
+    except smtplib.SMTPAuthenticationError:
+        raise
+    except Exception as e:
+        # Connecting failed, or the server went away even after reconnecting
+        results.extend([(False, f"Failed to send email: {str(e)}")] * (len(reports) - len(results)))
+    return results
 
-Attached is your WhatsApp Chat Analysis Report that you requested from my analysis tool.
+# Defaults for the async sender: SMTP sessions used at once, and seconds
+# allowed per recipient including (re)connecting
+ASYNC_SMTP_CONCURRENCY = 8
+ASYNC_SEND_TIMEOUT = 60
 
-Thank you for using my service!
--Bhoomika 
+async def _open_async(email_config):
+    """Connect, upgrade to TLS and log in if the server asks for it, without blocking the event loop"""
+    smtp = aiosmtplib.SMTP(
+        hostname=email_config['smtp_server'],
+        port=email_config['smtp_port'],
+        timeout=email_config['smtp_timeout'],
+        start_tls=email_config['smtp_starttls']
+    )
+    await smtp.connect()
+    try:
+        if smtp.is_ehlo_or_helo_needed:
+            await smtp.ehlo()
+        if smtp.supports_extension('auth'):
+            if not email_config['sender_password']:
+                raise aiosmtplib.SMTPAuthenticationError(530, _LOGIN_REQUIRED)
+            await smtp.login(email_config['sender_email'], email_config['sender_password'])
+    except Exception:
+        smtp.close()
+        raise
+    return smtp
 
-"""
-        msg.attach(MIMEText(body, 'plain'))
-        
-        # Attach the PDF
-        pdf_buffer.seek(0)  # Reset buffer pointer to the beginning
-        attachment = MIMEBase('application', 'pdf')
-        attachment.set_payload(pdf_buffer.read())
-        encoders.encode_base64(attachment)
-        attachment.add_header('Content-Disposition', f'attachment; filename="{filename}"')
-        msg.attach(attachment)
+async def _close_async(smtp):
+    """Quit a session, ignoring a server that already went away"""
+    try:
+        await smtp.quit()
+    except Exception:
+        smtp.close()
+
+async def send_pdf_reports_async(reports, concurrency=ASYNC_SMTP_CONCURRENCY, timeout=ASYNC_SEND_TIMEOUT, email_config=None):
+    """
+    Send many PDF reports concurrently over at most `concurrency` SMTP sessions
+    
+    Args:
+        reports (iterable): (recipient_email, pdf_buffer, filename, user_name) tuples
+        concurrency (int): Sessions open at once; each one sends its share of the reports in turn
+        timeout (float): Seconds allowed per recipient, including connecting
+        email_config (dict, optional): Defaults to get_email_config()
+    
+    Returns:
+        list: a dict per report, in order, with recipient_email, success, message and seconds
+    """
+    reports = list(reports)
+    email_config = email_config or get_email_config()
+    results = [None] * len(reports)
+    
+    if not email_config['sender_email']:
+        for index, report in enumerate(reports):
+            results[index] = {'recipient_email': report[0], 'success': False, 'seconds': 0.0,
+                              'message': "Email configuration is missing. Please contact the administrator."}
+        return results
+    
+    queue = asyncio.Queue()
+    for item in enumerate(reports):
+        queue.put_nowait(item)
+    
+    async def worker():
+        # One session per worker, reused for every report it picks up
+        session = {'smtp': None}
         
-        # Connect to server and send email
-        server = smtplib.SMTP(email_config['smtp_server'], email_config['smtp_port'])
-        server.starttls()  # Secure the connection
-        server.login(email_config['sender_email'], email_config['sender_password'])
-        server.send_message(msg)
-        server.quit()
+        async def deliver(recipient_email, message):
+            if session['smtp'] is None:
+                session['smtp'] = await _open_async(email_config)
+            await session['smtp'].sendmail(email_config['sender_email'], [recipient_email], message)
         
-        return True, "Report sent successfully to your email address!"
+        try:
+            while not queue.empty():
+                index, (recipient_email, pdf_buffer, filename, user_name) = queue.get_nowait()
+                start = time.perf_counter()
+                try:
+                    # aiosmtplib has no streaming DATA, so join the chunks once
+                    message = b"".join(_iter_message_bytes(email_config, recipient_email, pdf_buffer, filename, user_name))
+                    await asyncio.wait_for(deliver(recipient_email, message), timeout)
+                    success, message = True, "Report sent successfully to your email address!"
+                except Exception as e:
+                    # The session may be mid-transaction; start the next report on a fresh one
+                    if session['smtp'] is not None:
+                        session['smtp'].close()
+                        session['smtp'] = None
+                    if isinstance(e, asyncio.TimeoutError):
+                        message = f"Failed to send email: timed out after {timeout}s"
+                    else:
+                        message = f"Failed to send email: {str(e)}"
+                    success = False
+                results[index] = {'recipient_email': recipient_email, 'success': success,
+                                  'message': message, 'seconds': time.perf_counter() - start}
+        finally:
+            if session['smtp'] is not None:
+                await _close_async(session['smtp'])
     
-    except Exception as e:
-        return False, f"Failed to send email: {str(e)}"
+    await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, len(reports))))))
+    return results
+
+async def send_pdf_report_async(recipient_email, pdf_buffer, filename, user_name=None, timeout=ASYNC_SEND_TIMEOUT):
+    """Async counterpart of send_pdf_report; returns (success, message)"""
+    result = (await send_pdf_reports_async([(recipient_email, pdf_buffer, filename, user_name)], timeout=timeout))[0]
+    return result['success'], result['message']
 
 def test_email_configuration():
-    """Test if email configuration is properly set up"""
-    config = load_email_config()
-    if not config['sender_email'] or not config['sender_password']:
+    """Test if email configuration is properly set up (a password is only needed by servers that ask for a login)"""
+    config = get_email_config()
+    if not config['sender_email']:
         return False
     return True
\ No newline at end of file
@@ -1,6 +1,15 @@
 import re
+import sys
+import hashlib
+import os
+import functools
+import multiprocessing
+import multiprocessing.spawn
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from collections import Counter
 
+import numpy as np
 import pandas as pd
 import seaborn as sns
 import streamlit as st
@@ -8,39 +17,119 @@ from collections import Counter
 import matplotlib.pyplot as plt
 import urlextract
 import emoji
-from wordcloud import WordCloud
+from wordcloud import WordCloud, STOPWORDS
 import io  # Add this import for BytesIO
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
+from svglib.svglib import svg2rlg
 from datetime import datetime
+import chat_store
 
 
-def generateDataFrame(file):
-    data = file.read().decode("utf-8")
-    data = data.replace('\u202f', ' ')
-    data = data.replace('\n', ' ')
-    dt_format = '\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s?(?:AM\s|PM\s|am\s|pm\s)?-\s'
-    msgs = re.split(dt_format, data)[1:]
-    date_times = re.findall(dt_format, data)
-    date = []
-    time = []
-    for dt in date_times:
-        date.append(re.search('\d{1,2}/\d{1,2}/\d{2,4}', dt).group())
-        time.append(re.search('\d{1,2}:\d{2}\s?(?:AM|PM|am|pm)?', dt).group())
-    users = []
-    message = []
-    for m in msgs:
-        s = re.split('([\w\W]+?):\s', m)
-        if (len(s) < 3):
-            users.append("Notifications")
-            message.append(s[0])
+# One header per message, either the Android layout
+#   "12/31/23, 10:15 PM - Name: text"
+# or the iOS one
+#   "[31/12/23, 22:15:08] Name: text"
+# with "/", "." or "-" between the date fields depending on the locale
+_HEADER_RE = re.compile(
+    r'\u200e?(?P<bracket>\[)?'
+    r'(?P<date>\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}),?\s'
+    r'(?P<time>\d{1,2}:\d{2}(?::\d{2})?(?:\s?(?:AM|PM|am|pm))?)'
+    r'(?(bracket)\]\s|\s?-\s)'
+    r'(?P<body>.*)'
+)
+_SENDER_RE = re.compile(r'(?P<user>.+?):\s(?P<body>.*)')
+
+
+_COLUMNS = ["Date", "Time(U)", "User", "Message"]
+
+
+def _iter_lines(file, chunk_size):
+    # Read fixed-size byte chunks; a line cut by a chunk boundary is carried
+    # over and completed by the next chunk
+    carry = b''
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        lines = (carry + chunk).split(b'\n')
+        carry = lines.pop()
+        yield from lines
+    if carry:
+        yield carry
+
+
+def _parse_lines(lines):
+    # Yields (date, time, user, message) rows. A message is only complete once
+    # the next header is seen, so continuation lines are appended to it and
+    # multi-line bodies survive.
+    pending = None
+    body = None
+    for raw in lines:
+        line = raw.decode("utf-8-sig").replace('\u202f', ' ').rstrip('\r\n')
+        header = _HEADER_RE.match(line)
+        if header is None:
+            # Text before the first header is export preamble, not a message
+            if body is not None:
+                body.append(line)
+            continue
+        if pending is not None:
+            yield pending + ('\n'.join(body),)
+        sender = _SENDER_RE.match(header.group('body'))
+        if sender is None:
+            pending = (header.group('date'), header.group('time'), "Notifications")
+            body = [header.group('body')]
         else:
-            users.append(s[1])
-            message.append(s[2])
-    df = pd.DataFrame(list(zip(date, time, users, message)), columns=["Date", "Time(U)", "User", "Message"])
+            pending = (header.group('date'), header.group('time'), sender.group('user'))
+            body = [sender.group('body')]
+    if pending is not None:
+        yield pending + ('\n'.join(body),)
+
+
+def generateDataFrame(file):
+    # Single pass over the upload, line by line
+    df = pd.DataFrame(list(_parse_lines(file)), columns=_COLUMNS)
+    df.attrs['datetime_format'] = detectDateFormat(df)
+    return df
+
+
+def generateDataFrameBatches(file, chunk_size=1 << 20, batch_size=50000, keep=None):
+    """
+    Parse the upload incrementally, yielding DataFrames of at most batch_size
+    messages. Only one chunk of the file and one batch are held in memory,
+    unless a list is passed as keep: every batch is appended to it as well,
+    so concatBatches can build the whole frame afterwards without re-parsing.
+    """
+    rows = []
+    fmt = None
+    for row in _parse_lines(_iter_lines(file, chunk_size)):
+        rows.append(row)
+        if len(rows) >= batch_size:
+            batch = pd.DataFrame(rows, columns=_COLUMNS)
+            # The format is sniffed from the first batch and reused for the rest
+            fmt = fmt or detectDateFormat(batch)
+            batch.attrs['datetime_format'] = fmt
+            if keep is not None:
+                keep.append(batch)
+            yield batch
+            rows = []
+    if rows:
+        batch = pd.DataFrame(rows, columns=_COLUMNS)
+        batch.attrs['datetime_format'] = fmt or detectDateFormat(batch)
+        if keep is not None:
+            keep.append(batch)
+        yield batch
+
+
+def concatBatches(batches):
+    """The frame generateDataFrame returns, built from all of generateDataFrameBatches' batches"""
+    if not batches:
+        return generateDataFrame(io.BytesIO(b''))
+    df = pd.concat(batches, ignore_index=True)
+    df.attrs['datetime_format'] = batches[0].attrs['datetime_format']
     return df
 
 
@@ -52,49 +141,259 @@ def getUsers(df):
     return users
 
 
-def PreProcess(df,dayf):
-    df['Date'] = pd.to_datetime(df['Date'], dayfirst=dayf)
-    df['Time'] = pd.to_datetime(df['Time(U)']).dt.time
-    df['year'] = df['Date'].apply(lambda x: int(str(x)[:4]))
-    df['month'] = df['Date'].apply(lambda x: int(str(x)[5:7]))
-    df['date'] = df['Date'].apply(lambda x: int(str(x)[8:10]))
-    df['day'] = df['Date'].apply(lambda x: x.day_name())
-    df['hour'] = df['Time'].apply(lambda x: int(str(x)[:2]))
-    df['month_name'] = df['Date'].apply(lambda x: x.month_name())
+_DAY_ORDER = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+_MONTH_ORDER = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+                'August', 'September', 'October', 'November', 'December']
+
+
+def _date_order_cost(dates, fmt):
+    # Exports are chronological, so the right field order is the one that
+    # keeps the sampled dates in non-decreasing order; ties go to the order
+    # giving the shorter span, since consecutive messages cluster in time
+    parsed = pd.to_datetime(dates, format=fmt, errors='coerce')
+    violations = int(parsed.isna().sum() + (parsed.diff() < pd.Timedelta(0)).sum())
+    return violations, parsed.max() - parsed.min()
+
+
+def detectDateFormat(df, dayfirst=None, sample_size=1000):
+    """
+    Sniff the (date format, time format) pair of an export from its first
+    sample_size headers: day/month order, separator, 2- or 4-digit year,
+    12h or 24h clock and whether seconds are present (iOS).
+    Pass dayfirst to force the day/month order instead of detecting it.
+    """
+    if df.empty:
+        return '%d/%m/%y', '%H:%M'
+    dates = df['Date'].head(sample_size)
+    times = df['Time(U)'].head(sample_size)
+
+    sep = re.search(r'[/.-]', dates.iloc[0]).group()
+    fields = dates.str.split(sep, expand=True)
+    year = '%Y' if fields[2].str.len().max() == 4 else '%y'
+    day_first = f'%d{sep}%m{sep}{year}'
+    month_first = f'%m{sep}%d{sep}{year}'
+    if dayfirst is None:
+        first_over_12 = (fields[0].astype(int) > 12).any()
+        second_over_12 = (fields[1].astype(int) > 12).any()
+        if first_over_12 != second_over_12:
+            dayfirst = bool(first_over_12)
+        else:
+            dayfirst = _date_order_cost(dates, day_first) <= _date_order_cost(dates, month_first)
+    date_fmt = day_first if dayfirst else month_first
+
+    time_fmt = '%H:%M'
+    if times.str.count(':').max() == 2:
+        time_fmt += ':%S'
+    if times.str[-2:].str.lower().isin(['am', 'pm']).any():
+        time_fmt = time_fmt.replace('%H', '%I')
+        time_fmt += ' %p' if times.str.contains(' ').any() else '%p'
+    return date_fmt, time_fmt
+
+
+def _parse_unique(values, fmt):
+    # A chat has far fewer distinct dates/times than messages, so parse each
+    # distinct string once and broadcast the result back by its code
+    codes, uniques = pd.factorize(values)
+    return pd.to_datetime(uniques, format=fmt)[codes]
+
+
+def PreProcess(df,dayf=None):
+    # dayf overrides the detected day/month order when given
+    if dayf is None:
+        date_fmt, time_fmt = df.attrs.get('datetime_format') or detectDateFormat(df)
+    else:
+        date_fmt, time_fmt = detectDateFormat(df, dayfirst=dayf)
+    days = _parse_unique(df['Date'], date_fmt)
+    clock = _parse_unique(df['Time(U)'], time_fmt)
+    stamp = pd.Series(days + (clock - clock.normalize()), index=df.index)
+    df['DateTime'] = stamp
+    df['Date'] = stamp.dt.normalize()
+    df['Time'] = stamp.dt.time
+    df['year'] = stamp.dt.year
+    df['month'] = stamp.dt.month
+    df['date'] = stamp.dt.day
+    df['day'] = pd.Categorical.from_codes(stamp.dt.dayofweek, categories=_DAY_ORDER, ordered=True)
+    df['hour'] = stamp.dt.hour
+    df['month_name'] = pd.Categorical.from_codes(stamp.dt.month - 1, categories=_MONTH_ORDER, ordered=True)
     return df
 
 
+# Parsed chats are memoized by content hash so reruns of the Streamlit script
+# (every widget interaction) don't re-parse the same upload
+CHAT_CACHE_MAX_ENTRIES = 8
+CHAT_CACHE_TTL = 60 * 60  # seconds
+_chat_cache_counters = Counter()
+
+
+def _with_date_order(df, dayf):
+    # Re-date a preprocessed chat with a forced day/month order. The date
+    # strings are rebuilt from the parsed dates with the detected format, so
+    # the chat store only needs to keep the auto-detected parse
+    date_fmt, _ = df.attrs['datetime_format']
+    df = df.copy()
+    df['Date'] = df['Date'].dt.strftime(date_fmt)
+    return PreProcess(df, dayf)
+
+
+@st.cache_data(max_entries=CHAT_CACHE_MAX_ENTRIES, ttl=CHAT_CACHE_TTL, show_spinner=False)
+def _load_chat(digest, dayf, username, _data, _parsed=None):
+    # Only runs on a cache miss; _data and _parsed are excluded from
+    # Streamlit's hashing because digest already identifies them. The
+    # account's on-disk store is tried before the already parsed frame, if
+    # any, and finally parsing the text.
+    _chat_cache_counters['misses'] += 1
+    df = chat_store.load_chat(username, digest) if username else None
+    if df is None:
+        df = PreProcess(_parsed if _parsed is not None else generateDataFrame(io.BytesIO(_data)))
+        df.attrs['digest'] = digest
+        if username:
+            chat_store.save_chat(username, digest, df)
+    return df if dayf is None else _with_date_order(df, dayf)
+
+
+def loadStoredChat(username, digest, dayf=None):
+    """A chat from the account's chat store, or None if it is no longer stored"""
+    df = chat_store.load_chat(username, digest)
+    if df is None or dayf is None:
+        return df
+    return _with_date_order(df, dayf)
+
+
+def uploadDigest(file):
+    """Content hash identifying an upload in the chat cache and chat store"""
+    return hashlib.sha256(file.getvalue()).hexdigest()
+
+
+def loadChat(file, dayf=None, username=None, parsed=None):
+    """
+    Parse and preprocess an uploaded chat, reusing a cached frame for identical
+    uploads. With a username, the frame is also kept in that account's
+    on-disk chat store. parsed, the upload already run through
+    generateDataFrame or concatBatches, saves parsing it again.
+    """
+    data = file.getvalue()
+    digest = uploadDigest(file)
+    _chat_cache_counters['calls'] += 1
+    return _load_chat(digest, dayf, username, data, parsed)
+
+
+def getChatCacheStats():
+    """Hit/miss counters of the parsed-chat cache for this process"""
+    calls = _chat_cache_counters['calls']
+    misses = _chat_cache_counters['misses']
+    return {'hits': calls - misses, 'misses': misses}
+
+
+@functools.lru_cache(maxsize=1)
+def _url_extractor():
+    # URLExtract loads its TLD list on construction, so build it once per process
+    return urlextract.URLExtract()
+
+
+def _link_counts(messages):
+    # Number of URLs in each message. URLs need a dot followed by a TLD, so
+    # only those messages go through URLExtract, and each distinct text is
+    # only scanned once
+    counts = pd.Series(0, index=messages.index)
+    candidates = messages[messages.str.contains(r'\.\w', regex=True)]
+    extractor = _url_extractor()
+    found = {text: len(extractor.find_urls(text)) for text in candidates.unique()}
+    counts[candidates.index] = candidates.map(found)
+    return counts
+
+
+def _message_masks(df):
+    # (media, deleted, keep) masks; keep marks real text messages
+    media = df['Message'] == "<Media omitted>"
+    deleted = df['Message'] == "This message was deleted"
+    notifications = df['User'] == 'Notifications'
+    return media, deleted, ~(media | deleted | notifications)
+
+
+def getTextMessages(df):
+    """Messages without media placeholders, deleted markers and notifications"""
+    _, _, keep = _message_masks(df)
+    # take() rather than a boolean slice, so later column assignments on the
+    # result don't raise SettingWithCopyWarning
+    return df.take(np.flatnonzero(keep))
+
+
 def getStats(df):
-    media = df[df['Message'] == "<Media omitted> "]
-    media_cnt = media.shape[0]
-    df.drop(media.index, inplace=True)
-    deleted_msgs = df[df['Message'] == "This message was deleted "]
-    deleted_msgs_cnt = deleted_msgs.shape[0]
-    df.drop(deleted_msgs.index, inplace=True)
-    temp = df[df['User'] == 'Notifications']
-    df.drop(temp.index, inplace=True)
-    print("h4")
-    extractor = urlextract.URLExtract()
-    print("h3")
-    links = []
-    for msg in df['Message']:
-        x = extractor.find_urls(msg)
-        if x:
-            links.extend(x)
-    links_cnt = len(links)
-    word_list = []
-    for msg in df['Message']:
-        word_list.extend(msg.split())
-    word_count = len(word_list)
+    # Counters come from boolean masks over the whole frame; the caller's
+    # frame is not modified, a filtered one is returned instead
+    media, deleted, keep = _message_masks(df)
+    media_cnt = int(media.sum())
+    deleted_msgs_cnt = int(deleted.sum())
+
+    df = getTextMessages(df)
+    links_cnt = int(_link_counts(df['Message']).sum())
+    word_count = int(df['Message'].str.count(r'\S+').sum())
     msg_count = df.shape[0]
     return df, media_cnt, deleted_msgs_cnt, links_cnt, word_count, msg_count
 
 
+def _emoji_trie_pattern(node):
+    # Regex for a trie of emoji sequences. Branches start with distinct
+    # characters and optional tails are greedy, so the regex always takes the
+    # longest emoji (ZWJ sequence, skin tone, flag, keycap) at a position.
+    alternatives = []
+    singles = []
+    for char in sorted(node):
+        if char == '':
+            continue
+        child = node[char]
+        if child.keys() == {''}:
+            singles.append(re.escape(char))
+        else:
+            alternatives.append(re.escape(char) + _emoji_trie_pattern(child))
+    if singles:
+        alternatives.append(singles[0] if len(singles) == 1 else '[' + ''.join(singles) + ']')
+    pattern = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+    if '' in node:
+        pattern = '(?:' + pattern + ')?'
+    return pattern
+
+
+@functools.lru_cache(maxsize=1)
+def _emoji_regexes():
+    # Returns (run_re, emoji_re). run_re finds runs of characters that can
+    # occur in an emoji using a compact class of code point ranges (a class of
+    # ~1400 astral characters would be tested linearly); emoji_re splits a run
+    # into whole emoji.
+    trie = {}
+    for sequence in emoji.EMOJI_DATA:
+        node = trie
+        for char in sequence:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    code_points = sorted({ord(char) for sequence in emoji.EMOJI_DATA for char in sequence if ord(char) >= 0x80})
+    ranges = [[code_points[0], code_points[0]]]
+    for cp in code_points[1:]:
+        if cp - ranges[-1][1] <= 64:
+            ranges[-1][1] = cp
+        else:
+            ranges.append([cp, cp])
+    char_class = ''.join(re.escape(chr(lo)) + '-' + re.escape(chr(hi)) for lo, hi in ranges)
+    # Keycaps start with an ASCII "#", "*" or digit
+    run_re = re.compile('[#*0-9]?[' + char_class + ']+')
+    return run_re, re.compile(_emoji_trie_pattern(trie))
+
+
+def _emoji_counts(messages):
+    # ASCII-only messages cannot contain an emoji, so only the rest is joined
+    # and scanned in one regex call; each distinct run is split once
+    run_re, emoji_re = _emoji_regexes()
+    text = '\n'.join([message for message in messages.tolist() if not message.isascii()])
+    emojis = Counter()
+    for run, n in Counter(run_re.findall(text)).items():
+        for found in emoji_re.findall(run):
+            emojis[found] += n
+    return emojis
+
+
 def getEmoji(df):
-    emojis = []
-    for message in df['Message']:
-        emojis.extend([c for c in message if c in emoji.EMOJI_DATA])
-    return pd.DataFrame(Counter(emojis).most_common(len(Counter(emojis))))
+    return pd.DataFrame(_emoji_counts(df['Message']).most_common())
 
 
 def getMonthlyTimeline(df):
@@ -109,156 +408,563 @@ def getMonthlyTimeline(df):
     return timeline
 
 
+@functools.lru_cache(maxsize=1)
+def _stop_words():
+    # Loaded once per process; a set gives exact, O(1) membership tests
+    with open('stop_hinglish.txt') as f:
+        return frozenset(f.read().split())
+
+
+def _word_counts(messages):
+    # The shared token stream behind MostCommonWords and create_wordcloud:
+    # lower-cased whitespace tokens with stop words removed. Joining the
+    # column first lets lower() and split() run once, in C.
+    stop_words = _stop_words()
+    tokens = ' '.join(messages.tolist()).lower().split()
+    return Counter([word for word in tokens if word not in stop_words])
+
+
+# WordCloud.generate's own tokenizer: no punctuation, no one-letter words
+_CLOUD_WORD_RE = re.compile(r"\w[\w']+")
+
+
+def _cloud_frequencies(word_counts):
+    # Re-tokenize the distinct tokens of _word_counts the way WordCloud.generate
+    # does (its pattern, trailing "'s" dropped, its stop words and bare numbers
+    # skipped), so the cloud shows words without reading the messages again
+    frequencies = Counter()
+    for token, count in word_counts.items():
+        for word in _CLOUD_WORD_RE.findall(token):
+            if word.endswith("'s"):
+                word = word[:-2]
+            if word not in STOPWORDS and not word.isnumeric():
+                frequencies[word] += count
+    return frequencies
+
+
 def MostCommonWords(df):
-    f = open('stop_hinglish.txt')
-    stop_words = f.read()
-    f.close()
-    words = []
-    for message in df['Message']:
-        for word in message.lower().split():
-            if word not in stop_words:
-                words.append(word)
-    return pd.DataFrame(Counter(words).most_common(20))
-
-def dailytimeline(df):
-    df['taarek'] = df['Date']
-    daily_timeline = df.groupby('taarek').count()['Message'].reset_index()
+    return pd.DataFrame(_word_counts(df['Message']).most_common(20))
+
+
+def aggregateBatches(batches, counters_only=False):
+    """
+    Compute the getStats counters, getEmoji and MostCommonWords over an
+    iterable of DataFrame batches (see generateDataFrameBatches). After each
+    batch the running totals are yielded, so a caller can show early results
+    while the rest of the file is still being read; the last item yielded
+    covers the whole chat. With counters_only, emojis and words aren't
+    counted and None is yielded in their place.
+    """
+    media_cnt = deleted_msgs_cnt = links_cnt = word_count = msg_count = 0
+    emojis = Counter()
+    words = Counter()
+    emoji_df = common_words = None
+    for batch in batches:
+        batch, media, deleted, links, batch_words, msgs = getStats(batch)
+        media_cnt += media
+        deleted_msgs_cnt += deleted
+        links_cnt += links
+        word_count += batch_words
+        msg_count += msgs
+        if not counters_only:
+            emojis.update(_emoji_counts(batch['Message']))
+            words.update(_word_counts(batch['Message']))
+            emoji_df = pd.DataFrame(emojis.most_common())
+            common_words = pd.DataFrame(words.most_common(20))
+        yield media_cnt, deleted_msgs_cnt, links_cnt, word_count, msg_count, emoji_df, common_words
+
+def _merge_partials(parts):
+    # Partial aggregates add up: counters are summed, count series are
+    # aligned on their index and summed
+    merged = {key: sum(part[key] for part in parts) for key in ('media', 'deleted', 'links', 'words', 'messages')}
+    for key in ('emojis', 'word_counts'):
+        merged[key] = Counter()
+        for part in parts:
+            merged[key].update(part[key])
+    for key in ('heatmap', 'monthly', 'daily'):
+        merged[key] = pd.concat([part[key] for part in parts]).groupby(level=list(range(parts[0][key].index.nlevels)), observed=True).sum()
+    return merged
+
+
+def _finalize_partial(part):
+    # Turn a partial aggregate into what the dashboard displays
+    day_hour = part['heatmap']
+    heatmap = day_hour.unstack(fill_value=0) if len(day_hour) else pd.DataFrame()
+    heatmap.columns = [_period_label(hour) for hour in heatmap.columns]
+    monthly = part['monthly']
+    timeline = monthly.rename('Message').reset_index()
+    timeline['time'] = timeline['month'].astype(str) + "-" + timeline['year'].astype(str)
+    month_counts = monthly.groupby(level='month').sum()
+    month_counts.index = [_MONTH_ORDER[month - 1] for month in month_counts.index]
+    return {
+        'media': int(part['media']),
+        'deleted': int(part['deleted']),
+        'links': int(part['links']),
+        'words': int(part['words']),
+        'messages': int(part['messages']),
+        'emoji_df': pd.DataFrame(part['emojis'].most_common()),
+        'common_words': pd.DataFrame(part['word_counts'].most_common(20)),
+        'word_counts': part['word_counts'],
+        'heatmap': heatmap,
+        'weekday': day_hour.groupby(level='day', observed=True).sum(),
+        'month_counts': month_counts,
+        'timeline': timeline,
+        'daily': part['daily'],
+    }
+
+
+def buildUserIndex(df):
+    """
+    Precompute the dashboard aggregates of a preprocessed chat for every user
+    in one grouped pass, plus 'Everyone' as the merge of the per-user partials.
+    Returns {user: aggregates}, so switching users is a dictionary lookup.
+    """
+    media, deleted, keep = _message_masks(df)
+    media_by_user = media.groupby(df['User']).sum()
+    deleted_by_user = deleted.groupby(df['User']).sum()
+
+    text = df.take(np.flatnonzero(keep))
+    per_message = pd.DataFrame({
+        'links': _link_counts(text['Message']),
+        'words': text['Message'].str.count(r'\S+'),
+    })
+    totals = per_message.groupby(text['User']).sum()
+    messages = text['User'].value_counts()
+    heatmaps = text.groupby(['User', 'day', 'hour'], observed=True).size()
+    monthly = text.groupby(['User', 'year', 'month']).size()
+    daily = text.groupby(['User', 'Date']).size()
+    empty = {
+        'heatmap': heatmaps.iloc[:0].droplevel('User'),
+        'monthly': monthly.iloc[:0].droplevel('User'),
+        'daily': daily.iloc[:0].droplevel('User'),
+    }
+
+    partials = {}
+    for user in df['User'].unique():
+        if user == 'Notifications':
+            continue
+        partials[user] = {
+            'media': media_by_user.get(user, 0),
+            'deleted': deleted_by_user.get(user, 0),
+            'links': totals['links'].get(user, 0),
+            'words': totals['words'].get(user, 0),
+            'messages': messages.get(user, 0),
+            'emojis': Counter(),
+            'word_counts': Counter(),
+        }
+        partials[user].update(empty)
+    # A chat without participant messages (empty, or only group notifications)
+    # still gets zeroed 'Everyone' aggregates
+    zero = dict(media=0, deleted=0, links=0, words=0, messages=0, emojis=Counter(), word_counts=Counter(), **empty)
+    for user, user_messages in text.groupby('User')['Message']:
+        partials[user]['emojis'] = _emoji_counts(user_messages)
+        partials[user]['word_counts'] = _word_counts(user_messages)
+    for key, series in (('heatmap', heatmaps), ('monthly', monthly), ('daily', daily)):
+        for user, user_series in series.groupby(level='User'):
+            partials[user][key] = user_series.droplevel('User')
+
+    index = {user: _finalize_partial(part) for user, part in partials.items()}
+    index['Everyone'] = _finalize_partial(_merge_partials(list(partials.values()) or [zero]))
+    return index
+
+
+@st.cache_data(max_entries=CHAT_CACHE_MAX_ENTRIES, ttl=CHAT_CACHE_TTL, show_spinner=False)
+def _load_user_index(digest, dayf, _df):
+    return buildUserIndex(_df)
+
+
+def loadUserIndex(df, dayf=None):
+    """buildUserIndex, cached per upload alongside the parsed chat"""
+    digest = df.attrs.get('digest')
+    if digest is None:
+        return buildUserIndex(df)
+    return _load_user_index(digest, dayf, df)
+
+
+def dailytimeline(daily_counts):
     fig, ax = plt.subplots()
     #ax.figure(figsize=(100, 80))
-    ax.plot(daily_timeline['taarek'], daily_timeline['Message'])
+    ax.plot(daily_counts.index, daily_counts.values)
     ax.set_ylabel("Messages Sent")
     st.title('Daily Timeline')
     st.pyplot(fig)
 
-def WeekAct(df):
-    x = df['day'].value_counts()
+def WeekAct(day_counts):
     fig, ax = plt.subplots()
-    ax.bar(x.index, x.values)
+    ax.bar(day_counts.index.astype(str), day_counts.values)
     ax.set_xlabel("Days")
     ax.set_ylabel("Message Sent")
     plt.xticks(rotation='vertical')
     st.pyplot(fig)
 
-def MonthAct(df):
-    x = df['month_name'].value_counts()
+def MonthAct(month_counts):
     fig, ax = plt.subplots()
-    ax.bar(x.index, x.values)
+    ax.bar(month_counts.index.astype(str), month_counts.values)
     ax.set_xlabel("Months")
     ax.set_ylabel("Message Sent")
     plt.xticks(rotation='vertical')
     st.pyplot(fig)
 
-def activity_heatmap(df):
-    period = []
-    for hour in df[['day', 'hour']]['hour']:
-        if hour == 23:
-            period.append(str(hour) + "-" + str('00'))
-        elif hour == 0:
-            period.append(str('00') + "-" + str(hour + 1))
-        else:
-            period.append(str(hour) + "-" + str(hour + 1))
+def _period_label(hour):
+    if hour == 23:
+        return str(hour) + "-" + str('00')
+    elif hour == 0:
+        return str('00') + "-" + str(hour + 1)
+    return str(hour) + "-" + str(hour + 1)
 
-    df['period'] = period
-    user_heatmap = df.pivot_table(index='day', columns='period', values='Message', aggfunc='count').fillna(0)
+def activity_heatmap(df):
+    df['period'] = df['hour'].map({hour: _period_label(hour) for hour in range(24)})
+    user_heatmap = df.pivot_table(index='day', columns='period', values='Message', aggfunc='count', observed=True).fillna(0)
     return user_heatmap
 
-def create_wordcloud(df):
-
-    f = open('stop_hinglish.txt', 'r')
-    stop_words = f.read()
-    f.close()
-    def remove_stop_words(message):
-        y = []
-        for word in message.lower().split():
-            if word not in stop_words:
-                y.append(word)
-        return " ".join(y)
-
+def create_wordcloud(df, word_counts=None):
+    # Pass word_counts (e.g. from buildUserIndex) to reuse an existing token
+    # stream instead of tokenizing the messages again
+    if word_counts is None:
+        word_counts = _word_counts(df['Message'])
     wc = WordCloud(width=500,height=500,min_font_size=10,background_color='white')
-    df['Message'] = df['Message'].apply(remove_stop_words)
-    df_wc = wc.generate(df['Message'].str.cat(sep=" "))
+    df_wc = wc.generate_from_frequencies(_cloud_frequencies(word_counts))
     return df_wc
 
-def calculate_response_times(df):
+# A gap longer than this starts a new conversation
+SESSION_IDLE_GAP = pd.Timedelta(hours=1)
+# Replies after a longer gap than this are not counted as responses
+RESPONSE_MAX_GAP = pd.Timedelta(hours=24)
 
-    import pandas as pd
-    import numpy as np
-    from datetime import datetime, timedelta
-    
-    # Make sure df is sorted chronologically
+def _sorted_timestamps(df):
+    # The chat in chronological order, with its timestamps. PreProcess already
+    # builds the timestamp; a stable sort on it gives the same order as
+    # sorting on (Date, Time), only faster.
+    if 'DateTime' in df:
+        df = df.sort_values(by='DateTime', kind='stable')
+        return df, df['DateTime']
     df = df.sort_values(by=['Date', 'Time'])
+    return df, pd.to_datetime(df['Date'].astype(str) + ' ' + df['Time'].astype(str))
+
+def _session_ids(stamps, idle_gap):
+    # Sorted timestamps -> session number, incremented after every idle gap
+    return (stamps.diff() > idle_gap).cumsum()
+
+def segment_sessions(df, idle_gap=SESSION_IDLE_GAP):
+    """
+    Split the chat into conversations in one pass over the sorted timestamps:
+    a new session starts whenever the gap since the previous message exceeds
+    idle_gap. Returns one row per session with its start, end, initiator,
+    participants and message count.
+    """
+    df, stamps = _sorted_timestamps(df)
+    messages = pd.DataFrame({
+        'Session': _session_ids(stamps, idle_gap).to_numpy(),
+        'Stamp': stamps.to_numpy(),
+        'User': df['User'].to_numpy(),
+    })
+    sessions = messages.groupby('Session').agg(
+        Start=('Stamp', 'first'),
+        End=('Stamp', 'last'),
+        Initiator=('User', 'first'),
+        Message_Count=('User', 'size'),
+        Participant_Count=('User', 'nunique'),
+    )
+    # Participant lists: deduplicate, sort by session, then split the user
+    # column at session boundaries (every session id occurs, in order)
+    members = messages[['Session', 'User']].drop_duplicates().sort_values(['Session', 'User'])
+    bounds = np.flatnonzero(np.diff(members['Session'].to_numpy())) + 1
+    sessions['Participants'] = [list(users) for users in np.split(members['User'].to_numpy(), bounds)] if len(members) else []
+    sessions['Duration_Min'] = (sessions['End'] - sessions['Start']).dt.total_seconds() / 60
+    return sessions.reset_index(drop=True)
+
+def calculate_response_times(df, max_gap=RESPONSE_MAX_GAP):
     
-    # Create a datetime column for accurate time difference calculation
-    df['DateTime'] = pd.to_datetime(df['Date'].astype(str) + ' ' + df['Time'].astype(str))
-    
-    # Initialize lists to store response data
-    responding_user = []
-    initiating_user = []
-    response_times = []
+    # Make sure df is sorted chronologically
+    df, stamps = _sorted_timestamps(df)
     
-    # Iterate through messages to calculate response times
-    for i in range(1, len(df)):
-        current_user = df.iloc[i]['User']
-        previous_user = df.iloc[i-1]['User']
-        
-        # Only calculate response time when the sender changes
-        if current_user != previous_user:
-            time_diff = (df.iloc[i]['DateTime'] - df.iloc[i-1]['DateTime']).total_seconds() / 60  # in minutes
-            
-            # Filter out unreasonably long response times (e.g., more than 24 hours)
-            if time_diff <= 24 * 60:  # 24 hours in minutes
-                responding_user.append(current_user)
-                initiating_user.append(previous_user)
-                response_times.append(time_diff)
+    # A response is a message whose sender differs from the previous message's
+    # sender within the same session, i.e. unreasonably long gaps (more than
+    # max_gap) are not responses
+    users = df['User']
+    previous_users = users.shift()
+    minutes = stamps.diff().dt.total_seconds() / 60
+    same_session = _session_ids(stamps, max_gap).diff() == 0
+    is_response = (users != previous_users) & same_session
     
     # Create DataFrame with all response times
     response_times_df = pd.DataFrame({
-        'Responder': responding_user,
-        'Initiator': initiating_user,
-        'ResponseTime_Minutes': response_times
+        'Responder': users[is_response].to_numpy(),
+        'Initiator': previous_users[is_response].to_numpy(),
+        'ResponseTime_Minutes': minutes[is_response].to_numpy()
     })
     
-    # Calculate statistics for each user
-    user_stats = []
-    
-    # Get unique users excluding 'Notifications'
-    unique_users = df['User'].unique()
-    unique_users = [user for user in unique_users if user != 'Notifications']
+    # Statistics for each user in one grouped pass, in order of first
+    # appearance and excluding users who never responded
+    stats = response_times_df.groupby('Responder')['ResponseTime_Minutes'].agg(['mean', 'median', 'max', 'min', 'count'])
+    order = [user for user in users.unique() if user != 'Notifications' and user in stats.index]
+    if not order:
+        return response_times_df, pd.DataFrame()
+    stats = stats.loc[order]
     
-    for user in unique_users:
-        # Get responses by this user
-        user_responses = response_times_df[response_times_df['Responder'] == user]
-        
-        if not user_responses.empty:
-            avg_time = user_responses['ResponseTime_Minutes'].mean()
-            median_time = user_responses['ResponseTime_Minutes'].median()
-            max_time = user_responses['ResponseTime_Minutes'].max()
-            min_time = user_responses['ResponseTime_Minutes'].min()
-            response_count = len(user_responses)
-            
-            # Calculate responsiveness percentage
-            total_responses_to_user = len(response_times_df[response_times_df['Initiator'] == user])
-            total_messages_to_user = total_responses_to_user  # Simplified metric
-            
-            responsiveness = 0 if total_messages_to_user == 0 else (response_count / total_messages_to_user) * 100
-            
-            user_stats.append({
-                'User': user,
-                'Avg_Response_Time_Min': round(avg_time, 2),
-                'Median_Response_Time_Min': round(median_time, 2),
-                'Max_Response_Time_Min': round(max_time, 2),
-                'Min_Response_Time_Min': round(min_time, 2),
-                'Response_Count': response_count,
-                'Responsiveness': round(responsiveness, 2)
-            })
+    # Responsiveness: responses given relative to responses received
+    received = response_times_df['Initiator'].value_counts().reindex(order, fill_value=0)
+    responsiveness = (stats['count'] / received.where(received > 0) * 100).fillna(0)
     
     # Create DataFrame with user statistics
-    user_response_stats_df = pd.DataFrame(user_stats)
+    user_response_stats_df = pd.DataFrame({
+        'User': order,
+        'Avg_Response_Time_Min': stats['mean'].round(2).to_numpy(),
+        'Median_Response_Time_Min': stats['median'].round(2).to_numpy(),
+        'Max_Response_Time_Min': stats['max'].round(2).to_numpy(),
+        'Min_Response_Time_Min': stats['min'].round(2).to_numpy(),
+        'Response_Count': stats['count'].to_numpy(),
+        'Responsiveness': responsiveness.round(2).to_numpy()
+    })
     
     return response_times_df, user_response_stats_df
 
-def generate_enhanced_pdf_report(df, media_cnt, deleted_msgs_cnt, links_cnt, word_count, msg_count, selected_user, emoji_df=None, common_words=None):
-    """Generate a PDF report with visualizations from chat analysis data"""
+def response_pairs(response_times_df, top_k=None):
+    """
+    Mean, median and count of response times for every (initiator, responder)
+    pair, in one grouped pass over calculate_response_times' output. Only pairs
+    that actually interacted get a row, busiest first; top_k keeps the top_k
+    busiest pairs.
+    """
+    pairs = (response_times_df.groupby(['Initiator', 'Responder'])['ResponseTime_Minutes']
+             .agg(['mean', 'median', 'count'])
+             .reset_index())
+    pairs.columns = ['Initiator', 'Responder', 'Avg_Response_Time_Min', 'Median_Response_Time_Min', 'Interaction_Count']
+    pairs[['Avg_Response_Time_Min', 'Median_Response_Time_Min']] = pairs[['Avg_Response_Time_Min', 'Median_Response_Time_Min']].round(2)
+    pairs = pairs.sort_values('Interaction_Count', ascending=False, kind='stable')
+    if top_k is not None:
+        pairs = pairs.head(top_k)
+    return pairs.reset_index(drop=True)
+
+# Below this share of interacting pairs the latency matrix is stored sparse
+SPARSE_MATRIX_DENSITY = 0.3
+
+def response_latency_matrix(response_times_df, value='Median_Response_Time_Min'):
+    """
+    Initiator x responder matrix of one response_pairs statistic. Pairs that
+    never interacted are NaN; in large groups where most pairs never talk, the
+    columns use a sparse dtype and are built straight from the observed pairs,
+    so memory grows with the pairs rather than with users squared.
+    """
+    pairs = response_pairs(response_times_df)
+    initiators = np.sort(pairs['Initiator'].unique())
+    responders = np.sort(pairs['Responder'].unique())
+    dense = not len(pairs) or len(pairs) / (len(initiators) * len(responders)) >= SPARSE_MATRIX_DENSITY
+    if not dense:
+        try:
+            # Private to pandas, so a version that moves it gets the dense matrix
+            from pandas._libs.sparse import IntIndex
+        except ImportError:
+            dense = True
+    if dense:
+        return pairs.pivot(index='Initiator', columns='Responder', values=value)
+
+    # Each responder column holds the values of its observed pairs at their
+    # initiator positions (COO layout); every other cell is the NaN fill value
+    pairs = pairs.assign(row=initiators.searchsorted(pairs['Initiator']),
+                         col=responders.searchsorted(pairs['Responder']))
+    pairs = pairs.sort_values(['col', 'row'])
+    columns = {}
+    for col, pair_group in pairs.groupby('col'):
+        sparse_index = IntIndex(len(initiators), pair_group['row'].to_numpy(np.int32))
+        columns[responders[col]] = pd.arrays.SparseArray(
+            pair_group[value].to_numpy(float), sparse_index=sparse_index, fill_value=np.nan)
+    matrix = pd.DataFrame(columns, index=pd.Index(initiators, name='Initiator'))
+    matrix.columns.name = 'Responder'
+    return matrix
+
+# Upper bound on processes used to render PDF charts
+CHART_WORKERS = 8
+# Python versions chart_worker's override of multiprocessing internals was checked on
+CHART_WORKER_PYTHONS = ((3, 8), (3, 13))
+
+# How charts are embedded in the PDF report. Raster profiles set the PNG
+# resolution and zlib level (0-9); 'vector' embeds charts as drawings, which
+# stay sharp at any zoom but grow with the number of plotted elements
+PDF_PROFILES = {
+    'email': {'format': 'png', 'dpi': 100, 'compress_level': 9},
+    'screen': {'format': 'png', 'dpi': 150, 'compress_level': 6},
+    'print': {'format': 'png', 'dpi': 300, 'compress_level': 6},
+    'vector': {'format': 'svg'},
+}
+DEFAULT_PDF_PROFILE = 'screen'
+
+def _chart_png(fig, profile):
+    # Save a finished figure in the profile's format for the PDF and free it.
+    # Only the figure's own methods are used, never pyplot's current figure,
+    # since charts may render in a job thread next to the dashboard's plots
+    img_byte_arr = io.BytesIO()
+    if profile['format'] == 'svg':
+        fig.savefig(img_byte_arr, format='svg', bbox_inches='tight')
+    else:
+        fig.savefig(img_byte_arr, format='png', dpi=profile['dpi'], bbox_inches='tight',
+                    pil_kwargs={'compress_level': profile['compress_level']})
+    plt.close(fig)
+    return img_byte_arr.getvalue()
+
+def _chart_flowable(data, profile, width, height):
+    # Wrap rendered chart bytes in a flowable of the given size
+    if profile['format'] == 'svg':
+        drawing = svg2rlg(io.BytesIO(data))
+        drawing.scale(width / drawing.width, height / drawing.height)
+        drawing.width, drawing.height = width, height
+        return drawing
+    return Image(io.BytesIO(data), width=width, height=height)
+
+def _chart_user_pie(user_counts, profile):
+    fig, ax = plt.subplots(figsize=(7, 5))
+    ax.pie(user_counts, labels=user_counts.index, autopct='%1.1f%%', startangle=90, 
+           shadow=True, explode=[0.05]*len(user_counts), wedgeprops={'edgecolor': 'white'})
+    ax.axis('equal')
+    ax.set_title('Message Distribution by User')
+    return _chart_png(fig, profile)
+
+def _chart_timeline(timeline, profile):
+    fig, ax = plt.subplots(figsize=(9, 4))
+    ax.plot(timeline['time'], timeline['Message'], marker='o', linestyle='-', linewidth=2, markersize=6, color='#128C7E')
+    ax.set_xlabel('Month-Year')
+    ax.set_ylabel('Number of Messages')
+    ax.set_title('Message Activity Over Time')
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+    fig.tight_layout()
+    return _chart_png(fig, profile)
+
+def _chart_weekdays(day_counts, profile):
+    fig, ax = plt.subplots(figsize=(8, 4))
+    bars = ax.bar(day_counts.index, day_counts.values, color='#128C7E')
+    ax.set_xlabel('Day of Week')
+    ax.set_ylabel('Number of Messages')
+    ax.set_title('Message Activity by Day of Week')
+    for bar in bars:
+        height = bar.get_height()
+        ax.text(bar.get_x() + bar.get_width()/2., height + 5,
+                f'{height}', ha='center', va='bottom')
+    fig.tight_layout()
+    return _chart_png(fig, profile)
+
+def _chart_heatmap(user_heatmap, profile):
+    fig, ax = plt.subplots(figsize=(10, 6))
+    sns.heatmap(user_heatmap, cmap='Greens', linewidths=0.5, ax=ax)
+    ax.set_title('Activity Heatmap: Message Timing by Day and Hour')
+    fig.tight_layout()
+    return _chart_png(fig, profile)
+
+def _chart_top_emojis(top_emojis, profile):
+    fig, ax = plt.subplots(figsize=(8, 4))
+    bars = ax.barh(top_emojis['Emoji'], top_emojis['Count'], color='#25D366')
+    ax.set_xlabel('Count')
+    ax.set_title('Top 10 Emojis Used')
+    ax.invert_yaxis()  # To have the highest count at the top
+    for bar in bars:
+        width = bar.get_width()
+        ax.text(width + 1, bar.get_y() + bar.get_height()/2, 
+               f'{width}', ha='left', va='center')
+    fig.tight_layout()
+    return _chart_png(fig, profile)
+
+def _chart_wordcloud(word_counts, profile):
+    wordcloud = create_wordcloud(None, word_counts)
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.imshow(wordcloud, interpolation='bilinear')
+    ax.axis('off')
+    fig.tight_layout()
+    return _chart_png(fig, profile)
+
+def _chart_common_words(common_words, profile):
+    fig, ax = plt.subplots(figsize=(8, 5))
+    bars = ax.barh(common_words['Word'][:15], common_words['Count'][:15], color='#34B7F1')
+    ax.set_xlabel('Count')
+    ax.set_title('Most Common Words Used')
+    ax.invert_yaxis()  # To have the highest count at the top
+    for bar in bars:
+        width = bar.get_width()
+        ax.text(width + 1, bar.get_y() + bar.get_height()/2, 
+               f'{width}', ha='left', va='center')
+    fig.tight_layout()
+    return _chart_png(fig, profile)
+
+def _chart_response_times(user_response_stats_df, profile):
+    fig, ax = plt.subplots(figsize=(8, 5))
+    bars = ax.bar(user_response_stats_df['User'], 
+                 user_response_stats_df['Avg_Response_Time_Min'],
+                 color='#128C7E')
+    ax.set_ylabel('Average Response Time (minutes)')
+    ax.set_title('Average Response Time by User')
+    ax.tick_params(axis='x', labelrotation=45)
+    for bar in bars:
+        height = bar.get_height()
+        ax.text(bar.get_x() + bar.get_width()/2., height + 0.5,
+               f'{height:.1f}', ha='center', va='bottom')
+    fig.tight_layout()
+    return _chart_png(fig, profile)
+
+def _chart_pool_supported():
+    # Workers need the forkserver start method, which Windows lacks, and
+    # chart_worker's hook that keeps them from re-running the app script;
+    # otherwise charts are rendered serially
+    return ('forkserver' in multiprocessing.get_all_start_methods()
+            and CHART_WORKER_PYTHONS[0] <= sys.version_info[:2] <= CHART_WORKER_PYTHONS[1]
+            and hasattr(multiprocessing.spawn, '_fixup_main_from_path'))
+
+@functools.lru_cache(maxsize=1)
+def _chart_pool():
+    # One pool per process, reused across reports. Workers are forked from a
+    # forkserver that has preloaded chart_worker rather than spawned, so they
+    # neither fork the threaded Streamlit server nor re-run the app script.
+    # The forkserver imports chart_worker from the working directory, the
+    # app directory, like stop_hinglish.txt
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['chart_worker'])
+    return ProcessPoolExecutor(
+        max_workers=min(CHART_WORKERS, os.cpu_count() or 1),
+        mp_context=context
+    )
+
+def _render_charts(jobs, parallel=True):
+    # jobs: [(render function, args)] -> PNG bytes in the same order
+    # A pool only pays off with more than one core to spread the charts over
+    if parallel and len(jobs) > 1 and (os.cpu_count() or 1) > 1 and _chart_pool_supported():
+        try:
+            futures = [_chart_pool().submit(func, *args) for func, args in jobs]
+            return [future.result() for future in futures]
+        except (BrokenProcessPool, OSError, ValueError):
+            # The pool died or couldn't start; drop it and render here instead
+            _chart_pool.cache_clear()
+    return [func(*args) for func, args in jobs]
+
+def build_analysis(df, selected_user, aggregates=None, user_counts=None, response_stats=None):
+    """
+    Bundle every artifact the PDF report lays out into one dict: the
+    aggregates of selected_user (as returned by loadUserIndex) plus
+    user_counts and response_stats for 'Everyone'. df is the text-only frame
+    of selected_user; anything not passed in is computed from it, so handing
+    over what the dashboard already computed makes the report pure layout.
+    """
+    if aggregates is None:
+        aggregates = buildUserIndex(df)['Everyone']
+    analysis = dict(aggregates, selected_user=selected_user, user_counts=None, response_stats=None)
+    if selected_user == "Everyone":
+        if user_counts is None:
+            user_counts = df['User'].value_counts()
+        user_counts = user_counts[user_counts.index != 'Notifications']  # Remove notifications
+        analysis['user_counts'] = user_counts
+        # Response times are only reported with at least 3 participants
+        if len(user_counts) > 2:
+            if response_stats is None:
+                response_stats = calculate_response_times(df)[1]
+            analysis['response_stats'] = response_stats
+    return analysis
+
+def generate_enhanced_pdf_report(df, media_cnt, deleted_msgs_cnt, links_cnt, word_count, msg_count, selected_user, emoji_df=None, common_words=None, parallel=True, profile=DEFAULT_PDF_PROFILE):
+    """Generate a PDF report with visualizations from chat analysis data; charts render in a process pool unless parallel=False"""
+    analysis = build_analysis(df, selected_user)
+    analysis.update(media=media_cnt, deleted=deleted_msgs_cnt, links=links_cnt, words=word_count,
+                    messages=msg_count, emoji_df=emoji_df, common_words=common_words)
+    return generate_analysis_report(analysis, parallel, profile)
+
+def generate_analysis_report(analysis, parallel=True, profile=DEFAULT_PDF_PROFILE):
+    """Lay out a PDF report from build_analysis output without recomputing anything; profile is a PDF_PROFILES key"""
     import io
     import matplotlib.pyplot as plt
     from datetime import datetime
@@ -270,12 +976,20 @@ def generate_enhanced_pdf_report(df, media_cnt, deleted_msgs_cnt, links_cnt, wor
     from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
     from reportlab.lib.units import inch
     
+    profile = PDF_PROFILES[profile]
     buffer = io.BytesIO()
     
     # Create the PDF object
     doc = SimpleDocTemplate(buffer, pagesize=letter)
     elements = []
     
+    # Charts are queued as (position in elements, renderer, args, width, height)
+    # and rendered together once the layout is known
+    charts = []
+    def add_chart(func, args, width, height):
+        charts.append((len(elements), func, args, width, height))
+        elements.append(None)
+    
     # Define styles
     styles = getSampleStyleSheet()
     title_style = ParagraphStyle(
@@ -302,6 +1016,8 @@ def generate_enhanced_pdf_report(df, media_cnt, deleted_msgs_cnt, links_cnt, wor
         spaceAfter=6
     )
     
+    selected_user = analysis['selected_user']
+    
     # Add title
     elements.append(Paragraph(f"WhatsApp Chat Analysis Report - {selected_user}", title_style))
     elements.append(Spacer(1, 12))
@@ -316,11 +1032,11 @@ def generate_enhanced_pdf_report(df, media_cnt, deleted_msgs_cnt, links_cnt, wor
     # Create statistics table
     stats_data = [
         ["Metric", "Value"],
-        ["Total Messages", str(msg_count)],
-        ["Total Words", str(word_count)],
-        ["Media Shared", str(media_cnt)],
-        ["Links Shared", str(links_cnt)],
-        ["Deleted Messages", str(deleted_msgs_cnt)]
+        ["Total Messages", str(analysis['messages'])],
+        ["Total Words", str(analysis['words'])],
+        ["Media Shared", str(analysis['media'])],
+        ["Links Shared", str(analysis['links'])],
+        ["Deleted Messages", str(analysis['deleted'])]
     ]
     
     stats_table = Table(stats_data, colWidths=[250, 100])
@@ -342,25 +1058,8 @@ def generate_enhanced_pdf_report(df, media_cnt, deleted_msgs_cnt, links_cnt, wor
         elements.append(Paragraph("User Activity Distribution", subtitle_style))
         
         # Create user activity pie chart instead of table
-        fig, ax = plt.subplots(figsize=(7, 5))
-        user_counts = df['User'].value_counts()
-        user_counts = user_counts[user_counts.index != 'Notifications']  # Remove notifications
-        ax.pie(user_counts, labels=user_counts.index, autopct='%1.1f%%', startangle=90, 
-               shadow=True, explode=[0.05]*len(user_counts), wedgeprops={'edgecolor': 'white'})
-        ax.axis('equal')
-        plt.title('Message Distribution by User')
-        
-        # Save the pie chart to a BytesIO object
-        img_byte_arr = io.BytesIO()
-        plt.savefig(img_byte_arr, format='png', dpi=300, bbox_inches='tight')
-        img_byte_arr.seek(0)
-        plt.close(fig)
-        
-        # Add the chart to the PDF
-        img = Image(img_byte_arr)
-        img.drawHeight = 3.5 * inch
-        img.drawWidth = 5 * inch
-        elements.append(img)
+        user_counts = analysis['user_counts']
+        add_chart(_chart_user_pie, (user_counts,), 5 * inch, 3.5 * inch)
         elements.append(Spacer(1, 12))
         
         # Add a small table with exact message counts
@@ -389,58 +1088,15 @@ def generate_enhanced_pdf_report(df, media_cnt, deleted_msgs_cnt, links_cnt, wor
     elements.append(Paragraph("Message Timeline", subtitle_style))
     
     # Create a line chart of messages over time
-    timeline = getMonthlyTimeline(df)
-    fig, ax = plt.subplots(figsize=(9, 4))
-    ax.plot(timeline['time'], timeline['Message'], marker='o', linestyle='-', linewidth=2, markersize=6, color='#128C7E')
-    ax.set_xlabel('Month-Year')
-    ax.set_ylabel('Number of Messages')
-    ax.set_title('Message Activity Over Time')
-    plt.xticks(rotation=45)
-    plt.grid(axis='y', linestyle='--', alpha=0.7)
-    plt.tight_layout()
-    
-    # Save the timeline chart to a BytesIO object
-    img_byte_arr = io.BytesIO()
-    plt.savefig(img_byte_arr, format='png', dpi=300, bbox_inches='tight')
-    img_byte_arr.seek(0)
-    plt.close(fig)
-    
-    # Add the chart to the PDF
-    img = Image(img_byte_arr)
-    img.drawHeight = 3 * inch
-    img.drawWidth = 6 * inch
-    elements.append(img)
+    add_chart(_chart_timeline, (analysis['timeline'][['time', 'Message']],), 6 * inch, 3 * inch)
     elements.append(Spacer(1, 20))
     
     # Add daily activity pattern
     elements.append(Paragraph("Day of Week Activity", subtitle_style))
     
     # Create a bar chart for messages by day of week
-    day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    day_counts = df['day'].value_counts().reindex(day_order)
-    
-    fig, ax = plt.subplots(figsize=(8, 4))
-    bars = ax.bar(day_counts.index, day_counts.values, color='#128C7E')
-    ax.set_xlabel('Day of Week')
-    ax.set_ylabel('Number of Messages')
-    ax.set_title('Message Activity by Day of Week')
-    for bar in bars:
-        height = bar.get_height()
-        ax.text(bar.get_x() + bar.get_width()/2., height + 5,
-                f'{height}', ha='center', va='bottom')
-    plt.tight_layout()
-    
-    # Save the day activity chart to a BytesIO object
-    img_byte_arr = io.BytesIO()
-    plt.savefig(img_byte_arr, format='png', dpi=300, bbox_inches='tight')
-    img_byte_arr.seek(0)
-    plt.close(fig)
-    
-    # Add the chart to the PDF
-    img = Image(img_byte_arr)
-    img.drawHeight = 3 * inch
-    img.drawWidth = 6 * inch
-    elements.append(img)
+    day_counts = analysis['weekday'].reindex(_DAY_ORDER)
+    add_chart(_chart_weekdays, (day_counts,), 6 * inch, 3 * inch)
     elements.append(Spacer(1, 20))
     
     # Add hourly activity heatmap
@@ -448,152 +1104,44 @@ def generate_enhanced_pdf_report(df, media_cnt, deleted_msgs_cnt, links_cnt, wor
     elements.append(Paragraph("When messages are sent throughout the day", normal_style))
     
     # Create activity heatmap
-    user_heatmap = activity_heatmap(df)
-    fig, ax = plt.subplots(figsize=(10, 6))
-    heatmap = sns.heatmap(user_heatmap, cmap='Greens', linewidths=0.5, ax=ax)
-    plt.title('Activity Heatmap: Message Timing by Day and Hour')
-    plt.tight_layout()
-    
-    # Save the heatmap to a BytesIO object
-    img_byte_arr = io.BytesIO()
-    plt.savefig(img_byte_arr, format='png', dpi=300, bbox_inches='tight')
-    img_byte_arr.seek(0)
-    plt.close(fig)
-    
-    # Add the heatmap to the PDF
-    img = Image(img_byte_arr)
-    img.drawHeight = 4 * inch
-    img.drawWidth = 7 * inch
-    elements.append(img)
+    add_chart(_chart_heatmap, (analysis['heatmap'],), 7 * inch, 4 * inch)
     elements.append(Spacer(1, 20))
     
     # Add emoji visualization if available
+    emoji_df = analysis['emoji_df']
     if emoji_df is not None and not emoji_df.empty:
         elements.append(Paragraph("Top Emojis Used", subtitle_style))
         
         # Create emoji bar chart (top 10)
-        emoji_df.columns = ['Emoji', 'Count']
-        top_emojis = emoji_df.head(10)
-        
-        fig, ax = plt.subplots(figsize=(8, 4))
-        bars = ax.barh(top_emojis['Emoji'], top_emojis['Count'], color='#25D366')
-        ax.set_xlabel('Count')
-        ax.set_title('Top 10 Emojis Used')
-        ax.invert_yaxis()  # To have the highest count at the top
-        
-        for i, bar in enumerate(bars):
-            width = bar.get_width()
-            ax.text(width + 1, bar.get_y() + bar.get_height()/2, 
-                   f'{width}', ha='left', va='center')
-        
-        plt.tight_layout()
-        
-        # Save the emoji chart to a BytesIO object
-        img_byte_arr = io.BytesIO()
-        plt.savefig(img_byte_arr, format='png', dpi=300, bbox_inches='tight')
-        img_byte_arr.seek(0)
-        plt.close(fig)
-        
-        # Add the chart to the PDF
-        img = Image(img_byte_arr)
-        img.drawHeight = 3.5 * inch
-        img.drawWidth = 6 * inch
-        elements.append(img)
+        top_emojis = emoji_df.head(10).set_axis(['Emoji', 'Count'], axis=1)
+        add_chart(_chart_top_emojis, (top_emojis,), 6 * inch, 3.5 * inch)
         elements.append(Spacer(1, 20))
     
     # Add word cloud visualization
     elements.append(Paragraph("Word Cloud Analysis", subtitle_style))
     
-    # Generate word cloud
-    wordcloud = create_wordcloud(df)
-    
-    # Plot the word cloud
-    fig, ax = plt.subplots(figsize=(10, 6))
-    ax.imshow(wordcloud, interpolation='bilinear')
-    ax.axis('off')
-    plt.tight_layout()
-    
-    # Save the word cloud to a BytesIO object
-    img_byte_arr = io.BytesIO()
-    plt.savefig(img_byte_arr, format='png', dpi=300, bbox_inches='tight')
-    img_byte_arr.seek(0)
-    plt.close(fig)
-    
-    # Add the word cloud to the PDF
-    img = Image(img_byte_arr)
-    img.drawHeight = 4 * inch
-    img.drawWidth = 6 * inch
-    elements.append(img)
+    # Generate word cloud; only the word counts cross to the worker
+    add_chart(_chart_wordcloud, (analysis['word_counts'],), 6 * inch, 4 * inch)
     elements.append(Spacer(1, 20))
     
     # Add common words visualization
+    common_words = analysis['common_words']
     if common_words is not None and not common_words.empty:
         elements.append(Paragraph("Most Common Words", subtitle_style))
         
         # Create common words bar chart
-        common_words.columns = ['Word', 'Count']
-        
-        fig, ax = plt.subplots(figsize=(8, 5))
-        bars = ax.barh(common_words['Word'][:15], common_words['Count'][:15], color='#34B7F1')
-        ax.set_xlabel('Count')
-        ax.set_title('Most Common Words Used')
-        ax.invert_yaxis()  # To have the highest count at the top
-        
-        for i, bar in enumerate(bars):
-            width = bar.get_width()
-            ax.text(width + 1, bar.get_y() + bar.get_height()/2, 
-                   f'{width}', ha='left', va='center')
-        
-        plt.tight_layout()
-        
-        # Save the common words chart to a BytesIO object
-        img_byte_arr = io.BytesIO()
-        plt.savefig(img_byte_arr, format='png', dpi=300, bbox_inches='tight')
-        img_byte_arr.seek(0)
-        plt.close(fig)
-        
-        # Add the chart to the PDF
-        img = Image(img_byte_arr)
-        img.drawHeight = 4 * inch
-        img.drawWidth = 6 * inch
-        elements.append(img)
+        top_words = common_words.head(15).set_axis(['Word', 'Count'], axis=1)
+        add_chart(_chart_common_words, (top_words,), 6 * inch, 4 * inch)
         elements.append(Spacer(1, 20))
     
-    # If we have at least 2 users and selected "Everyone", add response time analysis
-    if selected_user == "Everyone" and len(df['User'].unique()) > 2:
+    # If we have at least 3 users and selected "Everyone", add response time analysis
+    user_response_stats_df = analysis['response_stats']
+    if user_response_stats_df is not None:
         elements.append(Paragraph("Response Time Analysis", subtitle_style))
         
-        # Calculate response times
-        response_times_df, user_response_stats_df = calculate_response_times(df)
-        
         if not user_response_stats_df.empty:
             # Create response time comparison chart
-            fig, ax = plt.subplots(figsize=(8, 5))
-            bars = ax.bar(user_response_stats_df['User'], 
-                         user_response_stats_df['Avg_Response_Time_Min'],
-                         color='#128C7E')
-            ax.set_ylabel('Average Response Time (minutes)')
-            ax.set_title('Average Response Time by User')
-            plt.xticks(rotation=45)
-            
-            for bar in bars:
-                height = bar.get_height()
-                ax.text(bar.get_x() + bar.get_width()/2., height + 0.5,
-                       f'{height:.1f}', ha='center', va='bottom')
-                
-            plt.tight_layout()
-            
-            # Save the response time chart to a BytesIO object
-            img_byte_arr = io.BytesIO()
-            plt.savefig(img_byte_arr, format='png', dpi=300, bbox_inches='tight')
-            img_byte_arr.seek(0)
-            plt.close(fig)
-            
-            # Add the chart to the PDF
-            img = Image(img_byte_arr)
-            img.drawHeight = 3.5 * inch
-            img.drawWidth = 6 * inch
-            elements.append(img)
+            add_chart(_chart_response_times, (user_response_stats_df[['User', 'Avg_Response_Time_Min']],), 6 * inch, 3.5 * inch)
             elements.append(Spacer(1, 12))
             
             # Add response statistics table
@@ -627,6 +1175,11 @@ def generate_enhanced_pdf_report(df, media_cnt, deleted_msgs_cnt, links_cnt, wor
     elements.append(Paragraph("WhatsApp Chat Analysis Report • Generated with Python", 
                             ParagraphStyle('Footer', fontSize=8, textColor=colors.grey)))
     
+    # Render every chart at once and drop the images into their slots
+    rendered = _render_charts([(func, args + (profile,)) for _, func, args, _, _ in charts], parallel)
+    for (position, _, _, width, height), data in zip(charts, rendered):
+        elements[position] = _chart_flowable(data, profile, width, height)
+    
     # Build the PDF
     doc.build(elements)
     buffer.seek(0)
@@ -0,0 +1,349 @@
+import os
+import io
+import json
+import time
+import uuid
+import socket
+import smtplib
+import sqlite3
+import functools
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import functions
+import email_util
+import auth
+
+# PDF builds and report emails run on a small worker pool instead of the
+# Streamlit script thread. Job state lives in SQLite so the UI can poll it
+# across reruns, and email jobs (whose inputs are all on disk) are resumed
+# after a restart
+JOBS_DB = os.path.join("user_data", "jobs.sqlite3")
+REPORT_DIR = os.path.join("user_data", "reports")
+JOB_WORKERS = 2
+
+# SMTP failures are retried with exponential backoff: 2s, 4s, 8s, ...
+EMAIL_MAX_ATTEMPTS = 4
+EMAIL_BACKOFF_SECONDS = 2.0
+
+# Every process owns the jobs it runs and refreshes their heartbeat. Another
+# process only takes over jobs whose owner has stopped: exited (when on the
+# same host) or silent for JOB_STALE_AFTER seconds
+JOB_HEARTBEAT_INTERVAL = 15.0
+JOB_STALE_AFTER = 60.0
+OWNER_HOST = socket.gethostname()
+
+# Finished jobs and their report files are deleted after a day; until then a
+# report can be downloaded and emailed any number of times
+JOB_RETENTION_SECONDS = 24 * 60 * 60
+
+QUEUED, RUNNING, RETRYING, DONE, FAILED = 'queued', 'running', 'retrying', 'done', 'failed'
+ACTIVE_STATUSES = (QUEUED, RUNNING, RETRYING)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    username TEXT,
+    status TEXT NOT NULL,
+    progress TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    payload TEXT,
+    result_path TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    owner_host TEXT,
+    owner_pid INTEGER,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_user ON jobs (username, created);
+"""
+
+@functools.lru_cache(maxsize=1)
+def _init_db():
+    # Create the database once per process; WAL lets the UI poll while workers write
+    os.makedirs(os.path.dirname(JOBS_DB), exist_ok=True)
+    conn = sqlite3.connect(JOBS_DB, timeout=30, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        # Databases created before jobs had owners
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, sql_type in (('owner_host', 'TEXT'), ('owner_pid', 'INTEGER'), ('heartbeat', 'REAL')):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {sql_type}")
+    finally:
+        conn.close()
+
+def _connect():
+    """Open the job database"""
+    _init_db()
+    conn = sqlite3.connect(JOBS_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _update(job_id, **fields):
+    """Write some columns of a job"""
+    fields['updated'] = time.time()
+    columns = ", ".join(f"{name} = ?" for name in fields)
+    conn = _connect()
+    try:
+        conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+    finally:
+        conn.close()
+
+def _insert(kind, username, payload=None):
+    """Record a new queued job and return its id"""
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, username, status, progress, payload, created, updated, owner_host, owner_pid, heartbeat) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, username, QUEUED, "Waiting for a worker", json.dumps(payload), now, now, OWNER_HOST, os.getpid(), now)
+        )
+    finally:
+        conn.close()
+    return job_id
+
+def get_job(job_id):
+    """Current state of a job as a dict, or None if it doesn't exist"""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    job = dict(row)
+    job['payload'] = json.loads(job['payload']) if job['payload'] else None
+    return job
+
+def list_jobs(username, limit=10):
+    """Most recent jobs of one account, newest first"""
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            "SELECT id FROM jobs WHERE username = ? ORDER BY created DESC LIMIT ?", (username, limit)
+        ).fetchall()
+    finally:
+        conn.close()
+    return [get_job(row['id']) for row in rows]
+
+@functools.lru_cache(maxsize=1)
+def _executor():
+    # Created on first use; picks up jobs left behind by stopped processes and
+    # starts the thread that keeps this process's jobs alive
+    executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+    _recover(executor)
+    threading.Thread(target=_maintain, args=(executor,), name="job-maintenance", daemon=True).start()
+    return executor
+
+def _submit(executor, func, job_id, *args):
+    """Run a job on the pool; an unexpected error fails the job instead of vanishing with its future"""
+    def run():
+        try:
+            func(job_id, *args)
+        except Exception as e:
+            traceback.print_exc()
+            _update(job_id, status=FAILED, progress=None, error=f"Unexpected error: {e}")
+    return executor.submit(run)
+
+def _maintain(executor):
+    """Heartbeat this process's jobs, take over orphaned ones and prune old ones, for the life of the process"""
+    while True:
+        time.sleep(JOB_HEARTBEAT_INTERVAL)
+        try:
+            _heartbeat()
+            _recover(executor)
+            _prune()
+        except Exception:
+            traceback.print_exc()
+
+def _heartbeat():
+    """Mark the unfinished jobs of this process as still being worked on"""
+    conn = _connect()
+    try:
+        conn.execute(
+            f"UPDATE jobs SET heartbeat = ? WHERE owner_host = ? AND owner_pid = ? AND status IN ({', '.join('?' * len(ACTIVE_STATUSES))})",
+            (time.time(), OWNER_HOST, os.getpid(), *ACTIVE_STATUSES)
+        )
+    finally:
+        conn.close()
+
+def _pid_alive(pid):
+    """Check whether a process on this host is still running"""
+    if os.name == 'nt':
+        # Signal 0 is CTRL_C_EVENT on Windows; rely on the heartbeat there
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _owner_stopped(job, now):
+    """Whether the process that owns an unfinished job is gone"""
+    if job['heartbeat'] is None or job['heartbeat'] < now - JOB_STALE_AFTER:
+        return True
+    return job['owner_host'] == OWNER_HOST and not _pid_alive(job['owner_pid'])
+
+def _recover(executor):
+    """
+    Take over unfinished jobs whose owner has stopped: email jobs are resumed,
+    report builds are failed since their input was only in the owner's memory
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            f"SELECT * FROM jobs WHERE status IN ({', '.join('?' * len(ACTIVE_STATUSES))}) "
+            "AND NOT (owner_host IS ? AND owner_pid IS ?)",
+            (*ACTIVE_STATUSES, OWNER_HOST, os.getpid())
+        ).fetchall()
+        claimed = []
+        for row in rows:
+            if not _owner_stopped(row, now):
+                continue
+            # Claim the job unless another process has just done so
+            cursor = conn.execute(
+                "UPDATE jobs SET owner_host = ?, owner_pid = ?, heartbeat = ? "
+                "WHERE id = ? AND owner_host IS ? AND owner_pid IS ? AND heartbeat IS ?",
+                (OWNER_HOST, os.getpid(), now, row['id'], row['owner_host'], row['owner_pid'], row['heartbeat'])
+            )
+            if cursor.rowcount == 1:
+                claimed.append(row)
+    finally:
+        conn.close()
+    for row in claimed:
+        if row['kind'] == 'email':
+            _submit(executor, _run_email, row['id'])
+        else:
+            _update(row['id'], status=FAILED, progress=None, error="Interrupted by a restart, please generate the report again")
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _prune():
+    """Delete finished jobs older than JOB_RETENTION_SECONDS along with their report files"""
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    conn = _connect()
+    try:
+        # A report an email job is still sending is kept until the next round
+        sending = {json.loads(row['payload'])['pdf_path'] for row in conn.execute(
+            f"SELECT payload FROM jobs WHERE kind = 'email' AND status IN ({', '.join('?' * len(ACTIVE_STATUSES))})",
+            ACTIVE_STATUSES
+        )}
+        rows = [row for row in conn.execute(
+            "SELECT id, result_path FROM jobs WHERE status IN (?, ?) AND updated < ?", (DONE, FAILED, cutoff)
+        ) if row['result_path'] not in sending]
+        for row in rows:
+            if row['result_path']:
+                _remove_file(row['result_path'])
+        conn.executemany("DELETE FROM jobs WHERE id = ?", [(row['id'],) for row in rows])
+    finally:
+        conn.close()
+
+def submit_report(username, analysis, filename, profile=functions.DEFAULT_PDF_PROFILE, file_name=None, file_hash=None):
+    """
+    Queue a PDF build from build_analysis output and return the job id.
+    When done, the job's result_path holds the PDF; file_name and file_hash
+    are recorded in the account's history on success.
+    """
+    payload = {'filename': filename, 'profile': profile, 'file_name': file_name, 'file_hash': file_hash,
+               'selected_user': analysis['selected_user']}
+    executor = _executor()  # recovers older jobs before this one is queued
+    job_id = _insert('report', username, payload)
+    _submit(executor, _run_report, job_id, analysis)
+    return job_id
+
+def submit_email(username, recipient_email, pdf_path, filename, file_name=None, file_hash=None, selected_user=None):
+    """Queue sending a stored PDF to recipient_email, with retries, and return the job id"""
+    payload = {'recipient_email': recipient_email, 'pdf_path': pdf_path, 'filename': filename,
+               'file_name': file_name, 'file_hash': file_hash, 'selected_user': selected_user}
+    executor = _executor()  # recovers older jobs before this one is queued
+    job_id = _insert('email', username, payload)
+    _submit(executor, _run_email, job_id)
+    return job_id
+
+def _run_report(job_id, analysis):
+    """Worker: build the PDF and store it under REPORT_DIR"""
+    job = get_job(job_id)
+    payload = job['payload']
+    _update(job_id, status=RUNNING, progress="Building PDF report", attempts=1)
+    start = time.perf_counter()
+    try:
+        pdf_buffer = functions.generate_analysis_report(analysis, profile=payload['profile'])
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        path = os.path.join(REPORT_DIR, f"{job_id}.pdf")
+        with open(path, 'wb') as f:
+            f.write(pdf_buffer.getbuffer())
+    except Exception as e:
+        traceback.print_exc()
+        _update(job_id, status=FAILED, progress=None, error=f"Error generating enhanced PDF report: {e}")
+        return
+    summary = f"{payload['profile']} quality: {pdf_buffer.getbuffer().nbytes / 1024:.0f} KB in {time.perf_counter() - start:.1f} s"
+    _update(job_id, status=DONE, progress=summary, result_path=path)
+    if job['username'] and payload['file_name']:
+        auth.record_analysis(
+            job['username'],
+            payload['file_name'],
+            f"Downloaded Enhanced PDF Report for {payload['selected_user']}",
+            file_hash=payload['file_hash']
+        )
+
+def _run_email(job_id):
+    """Worker: send a stored PDF, retrying with exponential backoff"""
+    job = get_job(job_id)
+    payload = job['payload']
+    if not email_util.test_email_configuration():
+        # Retrying won't fix a missing configuration
+        _update(job_id, status=FAILED, progress=None, error="Email configuration is missing. Please contact the administrator.")
+        return
+
+    for attempt in range(job['attempts'] + 1, EMAIL_MAX_ATTEMPTS + 1):
+        _update(job_id, status=RUNNING, attempts=attempt, progress=f"Sending email (attempt {attempt} of {EMAIL_MAX_ATTEMPTS})")
+        try:
+            with open(payload['pdf_path'], 'rb') as f:
+                pdf_buffer = io.BytesIO(f.read())
+        except OSError as e:
+            _update(job_id, status=FAILED, progress=None, error=f"Report file is no longer available: {e}")
+            return
+        try:
+            success, message = email_util.send_pdf_report(
+                payload['recipient_email'],
+                pdf_buffer,
+                payload['filename'],
+                user_name=job['username']
+            )
+        except smtplib.SMTPAuthenticationError as e:
+            # Retrying won't fix refused or missing credentials either
+            _update(job_id, status=FAILED, progress=None, error=f"Failed to send email: {e}")
+            return
+        if success:
+            _update(job_id, status=DONE, progress=message, error=None)
+            if job['username'] and payload['file_name']:
+                auth.record_analysis(
+                    job['username'],
+                    payload['file_name'],
+                    f"Emailed Enhanced PDF Report for {payload['selected_user']}",
+                    file_hash=payload['file_hash']
+                )
+            return
+        if attempt < EMAIL_MAX_ATTEMPTS:
+            delay = EMAIL_BACKOFF_SECONDS * 2 ** (attempt - 1)
+            _update(job_id, status=RETRYING, error=message, progress=f"Retrying in {delay:.0f}s")
+            time.sleep(delay)
+        else:
+            _update(job_id, status=FAILED, progress=None, error=message)
+            return
+    # Resumed after a restart with every attempt already used
+    _update(job_id, status=FAILED, progress=None)
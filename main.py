@@ -6,10 +6,12 @@ from matplotlib.font_manager import FontProperties
 import seaborn as sns
 import functions
 import auth
+import chat_store
+import jobs
 import time
 from datetime import datetime
 import os
-# No need to import io here as it's now in functions.py
+import io
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 from reportlab.lib import colors
@@ -181,18 +183,34 @@ with st.sidebar:
         
             # Show user history
         with st.expander("Your Analysis History"):
-                history = auth.get_user_history(st.session_state.username)
-                if history:
-                    for i, entry in enumerate(reversed(history)):
-                        if i >= 5:  # Show only last 5 analyses
+                # Only the pages asked for are fetched, newest first
+                history_total = auth.count_user_history(st.session_state.username)
+                if history_total:
+                    pages = st.session_state.setdefault('history_pages', 1)
+                    cursor = None
+                    i = 0
+                    for _ in range(pages):
+                        entries, cursor = auth.get_user_history_page(st.session_state.username, cursor)
+                        for entry in entries:
+                            st.write(f"📊 {entry['file_name']} - {entry['timestamp'].strftime('%d %b, %H:%M')}")
+                            # Chats kept in the account's chat store can be reopened without re-uploading
+                            if entry.get('file_hash') and chat_store.has_chat(st.session_state.username, entry['file_hash']):
+                                if st.button("Reopen", key=f"reopen_{i}"):
+                                    st.session_state.reopen_chat = (entry['file_name'], entry['file_hash'])
+                            i += 1
+                        if cursor is None:
                             break
-                        st.write(f"📊 {entry['file_name']} - {entry['timestamp'].strftime('%d %b, %H:%M')}")
+                    st.caption(f"Showing {i} of {history_total} analyses")
+                    if cursor is not None and st.button("Show more", key="history_more"):
+                        st.session_state.history_pages = pages + 1
+                        st.rerun()
                 else:
                     st.write("No analysis history yet")
         
         # Logout button
         if st.button("Logout"):
             auth.logout_user()
+            st.session_state.pop('history_pages', None)
             st.rerun()  # Fixed: Changed from experimental_rerun to rerun
     
     st.markdown('</div>', unsafe_allow_html=True)
@@ -214,7 +232,8 @@ with st.sidebar:
                     auth.record_analysis(
                         st.session_state.username, 
                         st.session_state.file_name, 
-                        f"Analysis for {users_s}"
+                        f"Analysis for {users_s}",
+                        file_hash=st.session_state.get('file_hash')
                     )
 
 # Main page content
@@ -245,45 +264,90 @@ if st.session_state.logged_in:
     
     file = st.file_uploader("Choose WhatsApp chat export file (.txt)", type=["txt"])
     
-    # Process the uploaded file
+    # A fresh upload takes precedence over a chat reopened from the history
     if file:
-        st.session_state.file_name = file.name
+        st.session_state.pop('reopen_chat', None)
+    
+    # Process the uploaded file
+    if file or 'reopen_chat' in st.session_state:
+        st.session_state.file_name = file.name if file else st.session_state.reopen_chat[0]
         
         with st.spinner('Processing your chat file...'):
             try:
-                df = functions.generateDataFrame(file)
-                
-                # Storing users in session state for sidebar
-                users = functions.getUsers(df)
-                st.session_state.users = users
-                
-                # Date format selection with improved UI
+                # Date format is detected from the file; the user can still override it
                 st.markdown('<div class="card">', unsafe_allow_html=True)
                 st.subheader("Configure Chat Settings")
-                dayfirst = st.radio(
-                    "Select Date Format in the chat file:",
-                    ('dd-mm-yy', 'mm-dd-yy'),
+                date_order = st.radio(
+                    "Date Format in the chat file:",
+                    ('Auto-detect', 'dd-mm-yy', 'mm-dd-yy'),
                     horizontal=True
                 )
-                st.markdown('</div>', unsafe_allow_html=True)
                 
-                if dayfirst == 'dd-mm-yy':
+                if date_order == 'dd-mm-yy':
                     dayfirst = True
-                else:
+                elif date_order == 'mm-dd-yy':
                     dayfirst = False
+                else:
+                    dayfirst = None
+                
+                if file:
+                    # A chat this session hasn't read yet is parsed batch by batch, so
+                    # large exports show running totals before the full parse is done;
+                    # the same batches then make up the chat's frame
+                    digest = functions.uploadDigest(file)
+                    parsed = None
+                    if digest != st.session_state.get('file_hash') and not chat_store.has_chat(st.session_state.username, digest):
+                        preview = st.empty()
+                        kept = []
+                        batches = functions.generateDataFrameBatches(io.BytesIO(file.getvalue()), keep=kept)
+                        for media_cnt, deleted_msgs_cnt, links_cnt, word_count, msg_count, _, _ in functions.aggregateBatches(batches, counters_only=True):
+                            preview.caption(f"Reading chat: {msg_count} messages, {word_count} words, "
+                                            f"{media_cnt} media and {links_cnt} links so far")
+                        preview.empty()
+                        parsed = functions.concatBatches(kept)
+                    df = functions.loadChat(file, dayfirst, st.session_state.username, parsed)
+                else:
+                    df = functions.loadStoredChat(st.session_state.username, st.session_state.reopen_chat[1], dayfirst)
+                    if df is None:
+                        raise ValueError("The stored copy of this chat is no longer available, please upload it again")
+                st.session_state.file_hash = df.attrs.get('digest')
+                date_fmt, time_fmt = df.attrs['datetime_format']
+                cache_stats = functions.getChatCacheStats()
+                st.caption(f"Detected date format: {date_fmt} {time_fmt} · "
+                           f"parse cache {cache_stats['hits']} hits / {cache_stats['misses']} misses")
+                st.markdown('</div>', unsafe_allow_html=True)
+                
+                # Storing users in session state for sidebar
+                users = functions.getUsers(df)
+                st.session_state.users = users
                 
                 # Check if user has selected analysis in sidebar
                 if 'selected_user' in st.session_state:
+                    # Aggregates for every participant are computed once per upload,
+                    # so switching the selected user is just a lookup
+                    user_index = functions.loadUserIndex(df, dayfirst)
+                    if st.session_state.selected_user not in user_index:
+                        # Selection left over from a different chat
+                        st.session_state.selected_user = 'Everyone'
                     selected_user = st.session_state.selected_user
+                    aggregates = user_index[selected_user]
                     
                     st.markdown(f'<h2 class="sub-header">Analysis Results for: {selected_user}</h2>', unsafe_allow_html=True)
                     
-                    df = functions.PreProcess(df, dayfirst)
                     if selected_user != "Everyone":
                         df = df[df['User'] == selected_user]
                     
                     # Get statistics
-                    df, media_cnt, deleted_msgs_cnt, links_cnt, word_count, msg_count = functions.getStats(df)
+                    df = functions.getTextMessages(df)
+                    media_cnt = aggregates['media']
+                    deleted_msgs_cnt = aggregates['deleted']
+                    links_cnt = aggregates['links']
+                    word_count = aggregates['words']
+                    msg_count = aggregates['messages']
+                    
+                    # Filled in below when shown, and reused by the PDF report
+                    user_counts = None
+                    response_stats = None
                     
                     # Display chat statistics in an attractive layout
                     st.markdown('<h2 class="sub-header">Chat Overview</h2>', unsafe_allow_html=True)
@@ -361,7 +425,7 @@ if st.session_state.logged_in:
                     # Emoji Analysis
                     st.markdown('<h2 class="sub-header">Emoji Analysis</h2>', unsafe_allow_html=True)
                     
-                    emoji_df = functions.getEmoji(df)
+                    emoji_df = aggregates['emoji_df']
                     
                     if not emoji_df.empty:
                         emoji_df.columns = ['Emoji', 'Count']
@@ -470,7 +534,7 @@ if st.session_state.logged_in:
                     # Most Common Words Analysis
                     st.markdown('<h2 class="sub-header">Most Common Words</h2>', unsafe_allow_html=True)
                     
-                    common_words = functions.MostCommonWords(df)
+                    common_words = aggregates['common_words']
                     if not common_words.empty:
                         common_words.columns = ['Word', 'Count']
                         
@@ -495,7 +559,7 @@ if st.session_state.logged_in:
                             st.subheader("Word Cloud")
                             
                             try:
-                                word_cloud = functions.create_wordcloud(df)
+                                word_cloud = functions.create_wordcloud(df, aggregates['word_counts'])
                                 fig, ax = plt.subplots()
                                 plt.imshow(word_cloud, interpolation='bilinear')
                                 plt.axis('off')
@@ -517,25 +581,25 @@ if st.session_state.logged_in:
                     with col1:
                         st.markdown('<div class="card">', unsafe_allow_html=True)
                         st.subheader("Daily Activity")
-                        functions.WeekAct(df)
+                        functions.WeekAct(aggregates['weekday'])
                         st.markdown('</div>', unsafe_allow_html=True)
                     
                     with col2:
                         st.markdown('<div class="card">', unsafe_allow_html=True)
                         st.subheader("Monthly Activity")
-                        functions.MonthAct(df)
+                        functions.MonthAct(aggregates['month_counts'])
                         st.markdown('</div>', unsafe_allow_html=True)
                     
                     # Daily timeline
                     st.markdown('<div class="card">', unsafe_allow_html=True)
-                    functions.dailytimeline(df)
+                    functions.dailytimeline(aggregates['daily'])
                     st.markdown('</div>', unsafe_allow_html=True)
                     
                     # Activity heatmap
                     st.markdown('<div class="card">', unsafe_allow_html=True)
                     st.subheader("Activity Heatmap")
                     
-                    user_heatmap = functions.activity_heatmap(df)
+                    user_heatmap = aggregates['heatmap']
                     fig, ax = plt.subplots(figsize=(12, 8))
                     sns.heatmap(user_heatmap, cmap="YlGnBu", ax=ax)
                     plt.title('Activity Heat Map')
@@ -547,6 +611,35 @@ if st.session_state.logged_in:
                     # Add a divider
                     #st.markdown('<div class="section-divider"></div>', unsafe_allow_html=True)
                     
+                    # Conversation sessions
+                    st.markdown('<div class="section-divider"></div>', unsafe_allow_html=True)
+                    st.markdown('<h2 class="sub-header">Conversations</h2>', unsafe_allow_html=True)
+                    st.markdown('<div class="card">', unsafe_allow_html=True)
+                    
+                    idle_gap = st.slider("Minutes of silence that end a conversation", 10, 720, 60, step=10)
+                    sessions = functions.segment_sessions(df, pd.Timedelta(minutes=idle_gap))
+                    
+                    if not sessions.empty:
+                        conv_col1, conv_col2, conv_col3 = st.columns(3)
+                        with conv_col1:
+                            st.markdown(f"<p><span class='stat-label'>Conversations:</span> <span class='stat-number'>{len(sessions)}</span></p>", unsafe_allow_html=True)
+                        with conv_col2:
+                            st.markdown(f"<p><span class='stat-label'>Messages per Conversation:</span> <span class='stat-number'>{round(sessions['Message_Count'].mean(), 1)}</span></p>", unsafe_allow_html=True)
+                        with conv_col3:
+                            st.markdown(f"<p><span class='stat-label'>Avg Duration:</span> <span class='stat-number'>{round(sessions['Duration_Min'].mean(), 1)}m</span></p>", unsafe_allow_html=True)
+                        
+                        if selected_user == 'Everyone':
+                            st.subheader("Who Starts Conversations")
+                            starters = sessions['Initiator'].value_counts()
+                            fig, ax = plt.subplots()
+                            ax.bar(starters.index, starters.values, color=sns.color_palette("viridis", len(starters)))
+                            plt.xticks(rotation='vertical')
+                            plt.ylabel("Conversations Started")
+                            st.pyplot(fig)
+                    else:
+                        st.info("No conversations found in the selected chat.")
+                    st.markdown('</div>', unsafe_allow_html=True)
+                    
                                         # Add this code to main.py right after the Activity Patterns section
                     # (before the "Add a divider" line that comes before the PDF report section)
 
@@ -562,6 +655,8 @@ if st.session_state.logged_in:
                             # Calculate response times
                             with st.spinner("Calculating response times..."):
                                 response_times_df, user_response_stats_df = functions.calculate_response_times(df)
+                                # Keep the raw numbers for the PDF; the table below formats them as text
+                                response_stats = user_response_stats_df.copy()
                                 
                                 if not user_response_stats_df.empty:
                                     # Display statistics about response times
@@ -651,38 +746,18 @@ if st.session_state.logged_in:
                                     # Display most responsive pairs
                                     st.subheader("Most Responsive Conversation Pairs")
                                     
-                                    # Calculate average response time between each pair of users
-                                    pair_response_times = []
-                                    
-                                    for initiator in user_response_stats_df['User']:
-                                        for responder in user_response_stats_df['User']:
-                                            if initiator != responder:
-                                                pair_data = response_times_df[
-                                                    (response_times_df['Initiator'] == initiator) & 
-                                                    (response_times_df['Responder'] == responder)
-                                                ]
-                                                
-                                                if not pair_data.empty:
-                                                    avg_time = pair_data['ResponseTime_Minutes'].mean()
-                                                    count = len(pair_data)
-                                                    
-                                                    pair_response_times.append({
-                                                        'Initiator': initiator,
-                                                        'Responder': responder,
-                                                        'Avg_Response_Time_Min': round(avg_time, 2),
-                                                        'Interaction_Count': count
-                                                    })
+                                    # Pair statistics come from one grouped pass; only the busiest
+                                    # pairs are shown, fastest responders first
+                                    pair_df = functions.response_pairs(response_times_df, top_k=20)
                                     
-                                    if pair_response_times:
-                                        pair_df = pd.DataFrame(pair_response_times)
-                                        
-                                        # Sort by response time (ascending) to show fastest responders
+                                    if not pair_df.empty:
                                         pair_df = pair_df.sort_values('Avg_Response_Time_Min')
                                         
                                         # Format the time values
-                                        pair_df['Avg_Response_Time_Min'] = pair_df['Avg_Response_Time_Min'].apply(
-                                            lambda x: f"{int(x // 60)}h {int(x % 60)}m" if x >= 60 else f"{round(x, 1)}m"
-                                        )
+                                        for col in ['Avg_Response_Time_Min', 'Median_Response_Time_Min']:
+                                            pair_df[col] = pair_df[col].apply(
+                                                lambda x: f"{int(x // 60)}h {int(x % 60)}m" if x >= 60 else f"{round(x, 1)}m"
+                                            )
                                         
                                         # Show the pair stats table
                                         st.dataframe(
@@ -691,6 +766,7 @@ if st.session_state.logged_in:
                                                 "Initiator": st.column_config.TextColumn("Message Sender", help="Person who sent the initial message"),
                                                 "Responder": st.column_config.TextColumn("Responder", help="Person who responded"),
                                                 "Avg_Response_Time_Min": st.column_config.TextColumn("Avg Response Time", help="Average response time"),
+                                                "Median_Response_Time_Min": st.column_config.TextColumn("Median Response Time", help="Median response time"),
                                                 "Interaction_Count": st.column_config.NumberColumn("# of Interactions", help="Number of exchanges between this pair")
                                             },
                                             hide_index=True,
@@ -715,86 +791,91 @@ if st.session_state.logged_in:
                     st.markdown('<h2 class="sub-header">Generate Enhanced PDF Report</h2>', unsafe_allow_html=True)
                     st.markdown('<div class="card">', unsafe_allow_html=True)
 
+                    pdf_profile = st.selectbox(
+                        "Report quality",
+                        list(functions.PDF_PROFILES),
+                        index=list(functions.PDF_PROFILES).index(functions.DEFAULT_PDF_PROFILE),
+                        help="email: smallest file, screen: sharp on screens, print: 300 DPI charts, vector: charts as scalable drawings"
+                    )
+
                     col1, col2 = st.columns([1, 1])
 
+                    # Builds and sends run on the job queue; the buttons below only
+                    # submit work and show the latest state of the submitted jobs
                     with col1:
                         if st.button("Generate Enhanced PDF Report", key="enhanced_pdf_report"):
-                            with st.spinner("Generating enhanced PDF report..."):
-                                try:
-                                    pdf_buffer = functions.generate_enhanced_pdf_report(
-                                        df,
-                                        media_cnt,
-                                        deleted_msgs_cnt,
-                                        links_cnt,
-                                        word_count,
-                                        msg_count,
-                                        selected_user,
-                                        emoji_df=emoji_df if 'emoji_df' in locals() else None,
-                                        common_words=common_words if 'common_words' in locals() else None
-                                    )
-
-                                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                                    filename = f"enhanced_whatsapp_analysis_{selected_user}_{timestamp}.pdf"
-
-                                    st.session_state.pdf_buffer = pdf_buffer  # Store PDF in session state for email sending
-                                    st.session_state.pdf_filename = filename
+                            # Everything the dashboard computed above goes straight into
+                            # the report, so the job only lays out the pages
+                            analysis = functions.build_analysis(
+                                df,
+                                selected_user,
+                                aggregates,
+                                user_counts=user_counts,
+                                response_stats=response_stats
+                            )
+                            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                            st.session_state.report_job = jobs.submit_report(
+                                st.session_state.username,
+                                analysis,
+                                f"enhanced_whatsapp_analysis_{selected_user}_{timestamp}.pdf",
+                                profile=pdf_profile,
+                                file_name=st.session_state.file_name,
+                                file_hash=st.session_state.file_hash
+                            )
+                            st.session_state.pop('email_job', None)
 
+                        report_job = jobs.get_job(st.session_state.report_job) if 'report_job' in st.session_state else None
+                        if report_job is None:
+                            pass
+                        elif report_job['status'] in jobs.ACTIVE_STATUSES:
+                            st.info(f"Generating enhanced PDF report... {report_job['progress']}")
+                            st.button("Refresh status", key="refresh_report_job")
+                        elif report_job['status'] == jobs.DONE:
+                            if report_job['result_path'] and os.path.exists(report_job['result_path']):
+                                with open(report_job['result_path'], 'rb') as f:
                                     st.download_button(
                                         label="Download Enhanced PDF Report",
-                                        data=pdf_buffer,
-                                        file_name=filename,
+                                        data=f.read(),
+                                        file_name=report_job['payload']['filename'],
                                         mime="application/pdf",
                                         key="enhanced_pdf_download"
                                     )
-
-                                    st.success("Enhanced PDF report generated successfully!")
-
-                                    # Log the download
-                                    if st.session_state.username:
-                                        auth.record_analysis(
-                                            st.session_state.username,
-                                            st.session_state.file_name,
-                                            f"Downloaded Enhanced PDF Report for {selected_user}"
-                                        )
-
-                                except Exception as e:
-                                    st.error(f"Error generating enhanced PDF report: {e}")
+                                st.success("Enhanced PDF report generated successfully!")
+                            else:
+                                st.warning("This report has expired. Please generate it again.")
+                            st.caption(report_job['progress'])
+                        else:
+                            st.error(report_job['error'])
 
                     with col2:
                         # Only show email option if user is logged in and PDF is generated
-                        if st.session_state.logged_in and st.session_state.username and 'pdf_buffer' in st.session_state:
-                            if st.button("Email PDF Report", key="email_pdf_report"):
-                                with st.spinner("Sending PDF report to your email..."):
-                                    try:
-                                        # Get user email from auth system
-                                        users = auth.load_users()
-                                        user_email = users[st.session_state.username]['email']
-                                        
-                                        # Import email utility
-                                        from email_util import send_pdf_report
-                                        
-                                        # Send the email
-                                        success, message = send_pdf_report(
-                                            user_email, 
-                                            st.session_state.pdf_buffer,
-                                            st.session_state.pdf_filename,
-                                            user_name=st.session_state.username
-                                        )
-                                        
-                                        if success:
-                                            st.success(message)
-                                            # Log the email action
-                                            auth.record_analysis(
-                                                st.session_state.username,
-                                                st.session_state.file_name,
-                                                f"Emailed Enhanced PDF Report for {selected_user}"
-                                            )
-                                        else:
-                                            st.error(message)
-                                    
-                                    except Exception as e:
-                                        st.error(f"Error sending email: {e}")
-                        elif st.session_state.logged_in and 'pdf_buffer' not in st.session_state:
+                        if st.session_state.logged_in and st.session_state.username and report_job and report_job['status'] == jobs.DONE:
+                            if report_job['result_path'] and st.button("Email PDF Report", key="email_pdf_report"):
+                                # Get user email from auth system
+                                user_email = auth.get_user(st.session_state.username)['email']
+                                st.session_state.email_job = jobs.submit_email(
+                                    st.session_state.username,
+                                    user_email,
+                                    report_job['result_path'],
+                                    report_job['payload']['filename'],
+                                    file_name=st.session_state.file_name,
+                                    file_hash=st.session_state.file_hash,
+                                    selected_user=selected_user
+                                )
+
+                            email_job = jobs.get_job(st.session_state.email_job) if 'email_job' in st.session_state else None
+                            if email_job is None:
+                                pass
+                            elif email_job['status'] in jobs.ACTIVE_STATUSES:
+                                st.info(f"Sending PDF report to your email... {email_job['progress']}")
+                                if email_job['error']:
+                                    st.caption(f"Last attempt failed: {email_job['error']}")
+                                st.button("Refresh status", key="refresh_email_job")
+                            elif email_job['status'] == jobs.DONE:
+                                st.success(email_job['progress'])
+                            else:
+                                st.error(email_job['error'])
+                        elif st.session_state.logged_in and not (report_job and report_job['status'] == jobs.DONE):
                             st.info("Please generate a PDF report first before sending via email.")
                         elif not st.session_state.logged_in:
                             st.info("Please log in to use the email feature.")